@@ -1,13 +1,34 @@
-import requests
+import time
+STARTED = time.perf_counter()  # For the startup time printed once the window is up
+
 import json
 import tkinter as tk
 from tkinter import scrolledtext
-import threading
+import tkinter.font as tkfont
+import queue
 import re
-import time
+import os
+import sys
+import sqlite3
+import itertools
+from array import array
 
-# Base URL for your LM Studio instance (replace with actual address)
-BASE_URL = "http://localhost:1234"  # Example - check LM Studio's documentation
+from lmstudio_engine import (
+    CACHE_MODE,
+    WARM_POOL_PRELOAD_ON_START,
+    RESULTS_PAGE_SIZE,
+    available_models,
+    metrics,
+    endpoints,
+    results_store,
+    stream_generate,
+    GenerationCancelled,
+    ConversationSession,
+    Comparator,
+    GenerationEngine,
+    start_background_loop,
+    batch_main,
+)
 
 # Dark theme colors
 BG_COLOR = "#1e1e1e"
@@ -20,189 +41,102 @@ CODE_BG = "#1a1a1a"
 CODE_FG = "#0088ff"
 HEADING_FG = "#00ffaa"
 
-# API Key
-API_KEY = "sk-lm-J6JKbAiq:eq3B92fGGwdIneldysVH"
-
-# Store raw content for toggling
-response_content = {"left": "", "right": ""}
+# Whether each pane shows formatted or raw text; the text itself lives in the pane's VirtualOutput
 show_formatted = {"left": True, "right": True}
-loaded_models = {"left": None, "right": None}
-selected_models = {"left": 2, "right": 1}  # Track selections separately (left: gpt-oss, right: deepseek)
-model_instances = {"left": None, "right": None}  # Track model instance IDs
-
-available_models = [
-    "google/gemma-3-12b",
-    "deepseek/deepseek-r1-0528-qwen3-8b",
-    "openai/gpt-oss-20b"
-]
-
-def get_loaded_models():
-    """Get list of currently loaded models."""
-    endpoint = f"{BASE_URL}/api/v1/models"
-    
-    headers = {
-        "Authorization": f"Bearer {API_KEY}"
-    }
-    
-    try:
-        response = requests.get(endpoint, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("data", [])
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting loaded models: {e}")
-        return []
-
-def load_model(model_name):
-    """Load a model in LM Studio."""
-    endpoint = f"{BASE_URL}/api/v1/models/load"
-    
-    # Check for and unload any duplicate instances first
-    current_models = get_loaded_models()
-    for model in current_models:
-        model_id = model.get("id") or model.get("model")
-        if model_id and model_id.startswith(model_name + ":"):
-            # Found a duplicate, unload it
-            print(f"Unloading duplicate instance: {model_id}")
-            unload_model(model_name, specific_instance=model_id)
-    
-    data = {
-        "model": model_name,
-        "flash_attention": True
-    }
-    
-    try:
-        response = requests.post(endpoint, json=data)
-        response.raise_for_status()
-        result = response.json()
-        print(f"Model {model_name} loaded successfully")
-        return result
-    except requests.exceptions.RequestException as e:
-        print(f"Error loading model {model_name}: {e}")
-        return None
+selected_models = {}  # side -> index into available_models, set by add_pane
+render_models = {}  # side -> model whose answer the pane shows, set when a prompt is sent
 
-def unload_model(model_name, specific_instance=None):
-    """Unload a model in LM Studio.
-    
-    Args:
-        model_name (str): The name of the model to unload.
-        specific_instance (str, optional): The specific instance ID (e.g., 'model:2') to unload.
-                                          If None, unloads the base model.
-    """
-    endpoint = f"{BASE_URL}/api/v1/models/unload"
-    
-    # Use specific instance if provided, otherwise use base model name
-    unload_target = specific_instance if specific_instance else model_name
-    
-    data = {
-        "model": unload_target
-    }
-    
-    try:
-        response = requests.post(endpoint, json=data)
-        response.raise_for_status()
-        print(f"Model {unload_target} unloaded successfully")
-        return True
-    except requests.exceptions.RequestException as e:
-        print(f"Error unloading model {unload_target}: {e}")
-        return False
-
-def remove_duplicate_instances(model_name, keep=1):
-    """Unload duplicate loaded instances of a model, keeping only `keep` instances.
-
-    This scans currently loaded models for instance ids that start with
-    "{model_name}:" and unloads extras.
-    """
-    current_models = get_loaded_models()
-    instances = []
-    for m in current_models:
-        model_id = m.get("id") or m.get("model")
-        if model_id and model_id.startswith(model_name + ":"):
-            instances.append(model_id)
-
-    # If there are more instances than desired, unload the extras
-    if len(instances) > keep:
-        # Keep the first `keep` instances and unload the rest
-        to_unload = instances[keep:]
-        for inst in to_unload:
-            print(f"Found duplicate instance for {model_name}: {inst} - unloading")
-            unload_model(model_name, specific_instance=inst)
-
-def ensure_model_loaded(model_name, side):
-    """Ensure the specified model is loaded."""
-    current_models = get_loaded_models()
-    current_model_ids = [m.get("id") or m.get("model") for m in current_models]
-    
-    # Check if the model is already loaded
-    if model_name in current_model_ids:
-        # Model is already loaded, just update our tracking
-        loaded_models[side] = model_name
-        model_instances[side] = model_name
-    else:
-        # Model not loaded at all, load it
-        load_result = load_model(model_name)
-        if load_result:
-            loaded_models[side] = model_name
-            # Extract model instance ID from response
-            model_instances[side] = load_result.get("id") or load_result.get("model_id") or model_name
-        else:
-            loaded_models[side] = model_name
-            model_instances[side] = model_name
+MARKDOWN_SEPARATOR = "─" * 50 + "\n"
+_BULLET_RE = re.compile(r'^\s*-\s+')
+# Inline spans in priority order: ***bold italic***, **bold**, `code`, *italic*
+_INLINE_RE = re.compile(r'\*\*\*(.+?)\*\*\*|\*\*(.+?)\*\*|`(.+?)`|\*([^*]+)\*')
+_INLINE_TAGS = (None, "bolditalic", "bold", "code", "italic")
 
-def generate_text(model_name, prompt):
-    """
-    Generates text using a specified LLM model in LM Studio.
+def _markdown_line_runs(line, in_code):
+    """Render one source line to (text, tag) runs.
 
     Args:
-        model_name (str): The name of the model to use (e.g., "Llama-2-7b-Chat").
-        prompt (str): The input prompt for the model.
+        line (str): A single line without its trailing newline.
+        in_code (bool): Whether a ``` code block is open before this line.
 
     Returns:
-        tuple: (generated_text, model_instance_id) or (None, None) if an error occurred.
+        tuple: (runs, in_code) with the code block state after this line.
     """
+    if in_code:
+        if line.strip().startswith("```"):
+            return [("\n", None)], False
+        return [(line + "\n", "codeblock")], True
 
-    endpoint = f"{BASE_URL}/api/v1/chat"  # Assumed endpoint - check LM Studio docs
+    # Separator
+    if line.strip().startswith("---"):
+        return [(MARKDOWN_SEPARATOR, "separator")], False
+    # Headings
+    if line.startswith("# "):
+        return [(line[2:] + "\n", "heading1")], False
+    if line.startswith("## "):
+        return [(line[3:] + "\n", "heading2")], False
+    if line.startswith("### "):
+        return [(line[4:] + "\n", "heading3")], False
+    # Bullet points - optional whitespace then -
+    bullet = _BULLET_RE.match(line)
+    if bullet:
+        return [("  • " + line[bullet.end():] + "\n", None)], False
+    # Code block opening fence
+    if line.strip().startswith("```"):
+        return [("\n", None)], True
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-        # Add any authentication headers here if required by LM Studio
-    }
+    # Regular line with inline formatting, scanned once
+    runs = []
+    pos = 0
+    for match in _INLINE_RE.finditer(line):
+        if match.start() > pos:
+            runs.append((line[pos:match.start()], None))
+        group = match.lastindex
+        runs.append((match.group(group), _INLINE_TAGS[group]))
+        pos = match.end()
+    runs.append((line[pos:] + "\n", None))
+    return runs, False
 
-    data = {
-        "model": model_name,
-        "input": prompt,
-        "temperature": 0.7, # Adjust for creativity vs. determinism
-        # Add other parameters supported by LM Studio's API (e.g., top_p, frequency_penalty)
-    }
+def _merge_runs(runs):
+    """Join neighbouring runs that share a tag so they become one insert."""
+    merged = []
+    parts = []
+    current_tag = None
+    for text, tag in runs:
+        if not text:
+            continue
+        if parts and tag != current_tag:
+            merged.append(("".join(parts), current_tag))
+            parts = []
+        parts.append(text)
+        current_tag = tag
+    if parts:
+        merged.append(("".join(parts), current_tag))
+    return merged
 
-    response = requests.post(endpoint, headers=headers, data=json.dumps(data))
-    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-
-    response_json = response.json()
-    # Extract the message content from the 'output' array
-    message_content = None
-    model_id = response_json.get("model_id") or response_json.get("id") or model_name
-
-    try:
-        for output in response_json["output"]:
-            if output["type"] == "message":
-                message_content = output["content"]
-                break  # Stop after finding the first "message" type
-    except (KeyError, IndexError, TypeError) as e:
-        raise ValueError(f"Error parsing response: {e}. Check LM Studio's API response format.")
+def parse_markdown(content):
+    """Parse markdown into merged (text, tag) runs in a single pass."""
+    runs = []
+    in_code = False
+    for line in content.split('\n'):
+        line_runs, in_code = _markdown_line_runs(line, in_code)
+        runs.extend(line_runs)
+    if in_code:
+        runs.append(("\n", None))  # Unclosed code block at the end
+    return _merge_runs(runs)
 
-    # Extract stats if present
-    stats = response_json.get("stats") or response_json.get("metrics") or None
-
-    return message_content, model_id, stats
+def _insert_runs(text_widget, runs, index=tk.END):
+    """Insert (text, tag) runs with a single Tk call."""
+    if not runs:
+        return
+    args = []
+    for text, tag in runs:
+        args.append(text)
+        args.append(tag or "")
+    text_widget.insert(index, *args)
 
-def format_markdown(text_widget, content):
-    """Format and display markdown content in the text widget."""
-    text_widget.config(state=tk.NORMAL)
-    text_widget.delete(1.0, tk.END)
-    
-    # Configure tags for markdown styling
+def _configure_markdown_tags(text_widget):
+    """Configure tags for markdown styling."""
     text_widget.tag_config("heading1", font=("Arial", 16, "bold"), foreground=HEADING_FG)
     text_widget.tag_config("heading2", font=("Arial", 14, "bold"), foreground=HEADING_FG)
     text_widget.tag_config("heading3", font=("Arial", 12, "bold"), foreground=HEADING_FG)
@@ -212,300 +146,1014 @@ def format_markdown(text_widget, content):
     text_widget.tag_config("code", font=("Courier", 10), background=CODE_BG, foreground=CODE_FG)
     text_widget.tag_config("codeblock", font=("Courier", 10), background=CODE_BG, foreground=CODE_FG)
     text_widget.tag_config("separator", foreground="#666666")
-    
-    lines = content.split('\n')
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        
-        # Separator
-        if line.strip().startswith("---"):
-            text_widget.insert(tk.END, "─" * 50 + "\n", "separator")
-            i += 1
-        # Headings
-        elif line.startswith("# "):
-            text_widget.insert(tk.END, line[2:] + "\n", "heading1")
-            i += 1
-        elif line.startswith("## "):
-            text_widget.insert(tk.END, line[3:] + "\n", "heading2")
-            i += 1
-        elif line.startswith("### "):
-            text_widget.insert(tk.END, line[4:] + "\n", "heading3")
-            i += 1
-        # Bullet points - check if line starts with optional whitespace then -
-        elif re.match(r'^\s*-\s+', line):
-            bullet_text = re.sub(r'^\s*-\s+', '', line)
-            text_widget.insert(tk.END, "  • " + bullet_text + "\n")
-            i += 1
-        # Code blocks
-        elif line.strip().startswith("```"):
-            text_widget.insert(tk.END, "\n")
-            i += 1
-            while i < len(lines) and not lines[i].strip().startswith("```"):
-                text_widget.insert(tk.END, lines[i] + "\n", "codeblock")
-                i += 1
-            if i < len(lines):
-                i += 1  # Skip closing ```
-            text_widget.insert(tk.END, "\n")
-        # Regular lines with inline formatting
-        else:
-            j = 0
-            while j < len(line):
-                # Bold italic (***text***)
-                bolditalic_match = re.match(r'\*\*\*(.+?)\*\*\*', line[j:])
-                if bolditalic_match:
-                    text_widget.insert(tk.END, bolditalic_match.group(1), "bolditalic")
-                    j += len(bolditalic_match.group(0))
-                # Bold - match **text**
-                elif re.match(r'\*\*(.+?)\*\*', line[j:]):
-                    bold_match = re.match(r'\*\*(.+?)\*\*', line[j:])
-                    text_widget.insert(tk.END, bold_match.group(1), "bold")
-                    j += len(bold_match.group(0))
-                # Inline code - match `text`
-                elif line[j] == '`':
-                    code_match = re.match(r'`(.+?)`', line[j:])
-                    if code_match:
-                        text_widget.insert(tk.END, code_match.group(1), "code")
-                        j += len(code_match.group(0))
-                    else:
-                        text_widget.insert(tk.END, line[j])
-                        j += 1
-                # Italic - match *text* (but not ** which is bold)
-                elif line[j] == '*' and j + 1 < len(line) and line[j + 1] != '*':
-                    italic_match = re.match(r'\*(.+?)\*', line[j:])
-                    if italic_match and '**' not in italic_match.group(0):
-                        text_widget.insert(tk.END, italic_match.group(1), "italic")
-                        j += len(italic_match.group(0))
-                    else:
-                        text_widget.insert(tk.END, line[j])
-                        j += 1
-                else:
-                    text_widget.insert(tk.END, line[j])
-                    j += 1
-            text_widget.insert(tk.END, "\n")
-            i += 1
-    
+
+def format_markdown(text_widget, content):
+    """Format and display markdown content in the text widget."""
+    text_widget.config(state=tk.NORMAL)
+    text_widget.delete(1.0, tk.END)
+    _configure_markdown_tags(text_widget)
+    _insert_runs(text_widget, parse_markdown(content))
     text_widget.config(state=tk.DISABLED)
 
+VIEW_CHUNK_LINES = 512  # Lines frozen together into one buffer chunk
+VIEW_MARGIN_LINES = 100  # Lines rendered above and below the visible ones
+
+class TextBuffer:
+    """Append-only text kept as chunks of lines with precomputed offsets.
+
+    Complete lines are frozen into one string per VIEW_CHUNK_LINES lines
+    together with an array of line start offsets, so any line is found by
+    index arithmetic and a slice instead of scanning the text. The markdown
+    code block state before every line is kept as one byte per line, so
+    any range of lines can be formatted without parsing what comes before.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._chunks = []  # Frozen strings of VIEW_CHUNK_LINES lines each
+        self._offsets = []  # array of line start offsets per chunk, plus the chunk length
+        self._open = []  # Complete lines not yet frozen
+        self._partial = ""  # Text after the last newline
+        self._complete = 0
+        self._in_code = False  # Code block state after the last complete line
+        self.code_state = bytearray()  # Code block state before each complete line
+        self.length = 0
+
+    @property
+    def line_count(self):
+        """Lines in the text; the part after the last newline counts as one."""
+        return self._complete + 1
+
+    def append(self, text):
+        """Add `text` and return the number of lines it completed."""
+        if not text:
+            return 0
+        self.length += len(text)
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.code_state.append(self._in_code)
+            # Inside a block a fence closes it, outside one it opens it
+            self._in_code = self._in_code != line.strip().startswith("```")
+            self._open.append(line)
+            if len(self._open) == VIEW_CHUNK_LINES:
+                self._freeze()
+        self._complete += len(lines)
+        return len(lines)
+
+    def _freeze(self):
+        offsets = array("I", [0])
+        for line in self._open:
+            offsets.append(offsets[-1] + len(line) + 1)
+        self._chunks.append("\n".join(self._open) + "\n")
+        self._offsets.append(offsets)
+        self._open = []
+
+    def in_code_at(self, index):
+        """Whether a code block is open before line `index`."""
+        return bool(self.code_state[index]) if index < self._complete else self._in_code
+
+    def lines(self, start, stop):
+        """Return lines start..stop-1 without their newlines."""
+        stop = min(stop, self.line_count)
+        result = []
+        frozen = len(self._chunks) * VIEW_CHUNK_LINES
+        index = max(start, 0)
+        while index < stop:
+            if index < frozen:
+                chunk_index, line_index = divmod(index, VIEW_CHUNK_LINES)
+                chunk, offsets = self._chunks[chunk_index], self._offsets[chunk_index]
+                end = min(stop - chunk_index * VIEW_CHUNK_LINES, VIEW_CHUNK_LINES)
+                for i in range(line_index, end):
+                    result.append(chunk[offsets[i]:offsets[i + 1] - 1])
+                index = chunk_index * VIEW_CHUNK_LINES + end
+            elif index < self._complete:
+                result.extend(self._open[index - frozen:stop - frozen])
+                index = min(stop, self._complete)
+            else:
+                result.append(self._partial)
+                index += 1
+        return result
+
+    def text(self):
+        """The whole text as one string."""
+        open_lines = "\n".join(self._open) + "\n" if self._open else ""
+        return "".join(self._chunks) + open_lines + self._partial
+
+    def is_prefix_of(self, content):
+        """Whether `content` starts with this buffer's text."""
+        return self.length <= len(content) and content.startswith(self.text())
+
+class VirtualOutput:
+    """A scrollable output pane that only renders the lines around the view.
+
+    The response lives in a TextBuffer; the Tk text widget holds just the
+    visible lines plus VIEW_MARGIN_LINES on each side, in either the
+    markdown view or the raw view. Scrolling near the edge of what is
+    rendered, dragging the scrollbar or toggling the view re-renders that
+    window only, so long answers cost the same to scroll and toggle as
+    short ones and the widget never holds more than a few hundred lines of
+    tags. Source line i is always display line i - first + 1.
+
+    While the end is in view, streamed text is appended to the widget like
+    a normal log and lines scrolled past the top margin are dropped.
+    """
+
+    def __init__(self, parent, **text_options):
+        self.frame = tk.Frame(parent, bg=text_options.get("bg", BG_COLOR))
+        self.scrollbar = tk.Scrollbar(self.frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text_widget = tk.Text(self.frame, yscrollcommand=self._on_text_scroll, **text_options)
+        self.text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        _configure_markdown_tags(self.text_widget)
+        self._line_height = max(tkfont.Font(font=self.text_widget.cget("font")).metrics("linespace"), 1)
+        self.buffer = TextBuffer()
+        self.formatted = True
+        self.follow = True  # Keep the end in view while text streams in
+        self.first = 0  # Source line shown on the widget's first line
+        self.rendered = 0  # Source lines currently in the widget
+        self.clear()
+
+    def _visible_lines(self):
+        return max(self.text_widget.winfo_height() // self._line_height, 1)
+
+    def _window_size(self):
+        return self._visible_lines() + 2 * VIEW_MARGIN_LINES
+
+    def _window_runs(self, start, stop):
+        """(text, tag) runs for source lines start..stop-1 in the current view."""
+        lines = self.buffer.lines(start, stop)
+        at_end = stop >= self.buffer.line_count
+        if not self.formatted:
+            return [("\n".join(lines) + ("" if at_end else "\n"), None)]
+        runs = []
+        in_code = self.buffer.in_code_at(start)
+        for line in lines:
+            line_runs, in_code = _markdown_line_runs(line, in_code)
+            runs.extend(line_runs)
+        if at_end and in_code:
+            runs.append(("\n", None))  # Unclosed code block at the end
+        return _merge_runs(runs)
+
+    def _render_window(self, first):
+        """Replace the widget content with the window starting at source line `first`."""
+        total = self.buffer.line_count
+        size = self._window_size()
+        first = max(0, min(first, total - size))
+        stop = min(total, first + size)
+        widget = self.text_widget
+        widget.config(state=tk.NORMAL)
+        widget.delete(1.0, tk.END)
+        _insert_runs(widget, self._window_runs(first, stop))
+        widget.config(state=tk.DISABLED)
+        self.first, self.rendered = first, stop - first
+
+    def clear(self):
+        """Forget the text and empty the widget."""
+        self.buffer.clear()
+        self.follow = True
+        self._render_window(0)
+
+    def set_text(self, text, formatted=True):
+        """Show `text` from the top, in the markdown or the raw view."""
+        self.buffer.clear()
+        self.buffer.append(text)
+        self.formatted = formatted
+        self.follow = True
+        self._render_window(0)
+
+    def render(self, content):
+        """Show `content` formatted, only appending if it extends the current text."""
+        if self.formatted and self.buffer.length and self.buffer.is_prefix_of(content):
+            self.append(content[self.buffer.length:])
+        else:
+            self.set_text(content)
+
+    def set_formatted(self, formatted):
+        """Switch between the markdown and raw views, keeping the scroll position."""
+        if formatted == self.formatted:
+            return
+        self.formatted = formatted
+        top = self.first + int(float(self.text_widget.yview()[0]) * self.rendered)
+        self._render_window(self.first)
+        self.text_widget.yview(f"{top - self.first + 1}.0")
+
+    def append(self, text):
+        """Add streamed text, rendering it only if the end of the text is rendered."""
+        old_total = self.buffer.line_count
+        covers_end = self.first + self.rendered >= old_total
+        self.buffer.append(text)
+        if not covers_end or not text:
+            return
+        widget = self.text_widget
+        widget.config(state=tk.NORMAL)
+        # The last line may have been partial; re-render it with the new text
+        widget.delete(f"{self.rendered}.0", tk.END)
+        last = old_total - 1
+        if not self.follow and self.rendered >= self._window_size():
+            # The reader scrolled up; stop growing the window until they come back down
+            self.rendered -= 1
+        else:
+            _insert_runs(widget, self._window_runs(last, self.buffer.line_count))
+            self.rendered = self.buffer.line_count - self.first
+            excess = self.rendered - self._window_size() - VIEW_MARGIN_LINES
+            if self.follow and excess > 0:
+                widget.delete(1.0, f"{excess + 1}.0")
+                self.first += excess
+                self.rendered -= excess
+        widget.config(state=tk.DISABLED)
+        if self.follow:
+            widget.see(tk.END)
+
+    def _on_text_scroll(self, lo, hi):
+        """Widget yscrollcommand: update the scrollbar and move the window if needed."""
+        lo, hi = float(lo), float(hi)
+        total = self.buffer.line_count
+        top = self.first + int(lo * self.rendered)
+        bottom = self.first + int(hi * self.rendered)
+        window_end = self.first + self.rendered
+        self.follow = hi >= 1.0 and window_end >= total
+        self.scrollbar.set(top / total if total else 0.0, min(max(bottom, top + 1) / total, 1.0) if total else 1.0)
+
+        near_top = self.first > 0 and top - self.first < VIEW_MARGIN_LINES // 2
+        near_bottom = window_end < total and window_end - bottom < VIEW_MARGIN_LINES // 2
+        if near_top or near_bottom:
+            self._render_window(top - VIEW_MARGIN_LINES)
+            self.text_widget.yview(f"{top - self.first + 1}.0")
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        """Scrollbar command: jump the window for drags, let the widget scroll otherwise."""
+        if action != tk.MOVETO:
+            self.text_widget.yview_scroll(int(amount), unit)
+            return
+        total = self.buffer.line_count
+        if self.first == 0 and self.rendered >= total:
+            self.text_widget.yview_moveto(amount)  # Everything is rendered
+            return
+        target = min(int(float(amount) * total), total - 1)
+        if not self.first <= target < self.first + self.rendered - self._visible_lines():
+            self._render_window(target - VIEW_MARGIN_LINES)
+        self.text_widget.yview(f"{target - self.first + 1}.0")
+
+def _show_plain(side, text):
+    """Replace a pane's content with unformatted text."""
+    panes[side]["view"].set_text(text, formatted=False)
 
 def _set_widget_message(text_widget, message, side=None, error=False):
     """Helper to set message into a widget and optionally format it.
 
-    If `side` is provided and `error` is False, the message is stored in
-    `response_content` and formatted for display. For errors, it simply
-    inserts the message.
+    If `side` is provided and `error` is False, the message is formatted
+    for display. For errors, it simply inserts the message.
     """
-    text_widget.config(state=tk.NORMAL)
-    text_widget.delete(1.0, tk.END)
-    text_widget.insert(tk.END, message)
-    text_widget.config(state=tk.DISABLED)
-
     if side and not error:
-        response_content[side] = message
         show_formatted[side] = True
-        button = button_left if side == "left" else button_right
-        button.config(text="Show Raw")
-        format_markdown(text_widget, message)
+        panes[side]["button"].config(text="Show Raw")
+        # Usually extends what was streamed, so only the new tail is rendered
+        panes[side]["view"].render(message)
+    elif side:
+        _show_plain(side, message)
+    else:
+        text_widget.config(state=tk.NORMAL)
+        text_widget.delete(1.0, tk.END)
+        text_widget.insert(tk.END, message)
+        text_widget.config(state=tk.DISABLED)
 
 def toggle_view(side):
     """Toggle between formatted and raw markdown view."""
     show_formatted[side] = not show_formatted[side]
-    text_widget = text_left if side == "left" else text_right
-    button = button_left if side == "left" else button_right
+    button = panes[side]["button"]
     
     button.config(text="Show Raw" if show_formatted[side] else "Show Formatted")
     
-    if show_formatted[side]:
-        format_markdown(text_widget, response_content[side])
-    else:
-        text_widget.config(state=tk.NORMAL)
-        text_widget.delete(1.0, tk.END)
-        text_widget.insert(tk.END, response_content[side])
-        text_widget.config(state=tk.DISABLED)
+    # Only the lines around the view are rendered again
+    panes[side]["view"].set_formatted(show_formatted[side])
 
-def generate_for_model(model_name, prompt_text, text_widget, side, expected_model_id):
-    """Generate text for a single model and update the UI."""
-    # Send the prompt immediately (fast path) and only pivot to loading/unloading on error
-    try:
-        generated_text, model_id, stats = generate_text(model_name, prompt_text)
-    except (requests.exceptions.RequestException, ValueError) as first_err:
-        # First attempt failed; pivot to ensure model is loaded and remove duplicates, then retry
-        print(f"Initial request failed for {model_name}: {first_err}. Pivoting to load/unload flow.")
+UI_FRAME_BUDGET_MS = 8  # Time the Tk thread may spend applying updates per frame
+UI_FRAME_INTERVAL_MS = 16  # Delay between frames while updates are waiting
+UI_IDLE_INTERVAL_MS = 50  # Polling delay when nothing is queued
 
-        # Start duplicate watcher while we attempt recovery and retry
-        stop_event = threading.Event()
-        def _duplicate_watcher():
-            while not stop_event.is_set():
-                try:
-                    remove_duplicate_instances(model_name, keep=1)
-                except Exception:
-                    pass
-                time.sleep(0.5)
+class UIDispatcher:
+    """Carries widget updates from worker threads to the Tk main thread.
 
-        watcher = threading.Thread(target=_duplicate_watcher, daemon=True)
-        watcher.start()
+    Tk is not thread-safe, so workers only call post(); the Tk thread drains
+    the queue from root.after callbacks. Updates are coalesced per side
+    before they are applied: consecutive "append" payloads are joined into
+    one, and a "reset", "set" or "compare" drops everything queued before it
+    for that side since it replaces the pane anyway. Each frame stops once
+    UI_FRAME_BUDGET_MS is spent and leaves the rest for the next frame, so a
+    burst of output never starves input handling.
 
-        try:
-            # Ensure model is loaded (this will attempt to load if missing)
-            ensure_model_loaded(model_name, side)
+    Handlers are called as handler(side, payload) on the Tk thread. If set,
+    on_render(side, seconds) is told how long each pane update took.
 
-            # Try one more time after recovery steps
+    begin(side) starts a new generation for a side and returns its id.
+    Updates posted with an older generation id are dropped when collected,
+    so a superseded prompt can never overwrite the pane of a newer one.
+    """
+
+    MERGEABLE = ("append",)
+    REPLACING = ("reset", "set", "compare")
+
+    def __init__(self, handlers, on_render=None):
+        self.handlers = dict(handlers)
+        self.on_render = on_render
+        self._incoming = queue.SimpleQueue()
+        self._pending = {}  # side -> [[command, payload], ...] in order, at most one of each kind
+        self._generations = {}  # side -> current generation id; only touched on the Tk thread
+        self._next_generation = itertools.count(1)
+        self._root = None
+        # Metrics
+        self.posted = 0
+        self.merged = 0
+        self.applied = 0
+        self.dropped = 0
+        self.frames = 0
+        self.last_frame_ms = 0.0
+        self.max_frame_ms = 0.0
+        self._total_frame_ms = 0.0
+
+    def post(self, command, side=None, payload=None, generation=None):
+        """Queue an update; safe to call from any thread."""
+        self._incoming.put((command, side, payload, generation))
+
+    def begin(self, side):
+        """Start a new generation for `side` on the Tk thread and return its id."""
+        self._collect()
+        self.dropped += len(self._pending.pop(side, ()))
+        generation = next(self._next_generation)
+        self._generations[side] = generation
+        return generation
+
+    def start(self, root):
+        """Begin draining on `root`'s event loop."""
+        self._root = root
+        root.after(UI_IDLE_INTERVAL_MS, self._drain)
+
+    def _collect(self):
+        """Move everything posted so far into the coalesced pending state."""
+        while True:
             try:
-                generated_text, model_id, stats = generate_text(model_name, prompt_text)
-            except Exception as retry_err:
-                stop_event.set()
-                watcher.join(timeout=1.0)
-                _set_widget_message(text_widget, f"Error after recovery attempt: {retry_err}", side=side, error=True)
+                command, side, payload, generation = self._incoming.get_nowait()
+            except queue.Empty:
                 return
+            self.posted += 1
+            if generation is not None and generation != self._generations.get(side):
+                self.dropped += 1  # Superseded by a newer prompt
+                continue
+            ops = self._pending.setdefault(side, [])
+            if command in self.REPLACING:
+                self.merged += len(ops)
+                ops[:] = [[command, payload]]
+            elif command in self.MERGEABLE and ops and ops[-1][0] == command:
+                ops[-1][1].append(payload)
+                self.merged += 1
+            elif command in self.MERGEABLE:
+                ops.append([command, [payload]])
+            else:
+                ops.append([command, payload])
 
-            # Stop watcher on success
-            stop_event.set()
-            watcher.join(timeout=1.0)
+    def _apply(self, side, command, payload):
+        if command in self.MERGEABLE:
+            payload = "".join(payload)
+        start = time.perf_counter()
+        self.handlers[command](side, payload)
+        if self.on_render:
+            self.on_render(side, time.perf_counter() - start)
+        self.applied += 1
 
+    def _drain(self):
+        start = time.perf_counter()
+        deadline = start + UI_FRAME_BUDGET_MS / 1000.0
+        try:
+            self._collect()
+            for side in list(self._pending):
+                ops = self._pending[side]
+                while ops and time.perf_counter() < deadline:
+                    command, payload = ops.pop(0)
+                    self._apply(side, command, payload)
+                if not ops:
+                    del self._pending[side]
         except Exception as e:
-            stop_event.set()
-            watcher.join(timeout=1.0)
-            print(f"Recovery failed for {model_name}: {e}")
-            _set_widget_message(text_widget, f"Error during recovery: {e}", side=side, error=True)
+            print(f"UI update failed: {e}")
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.frames += 1
+            self.last_frame_ms = elapsed_ms
+            self.max_frame_ms = max(self.max_frame_ms, elapsed_ms)
+            self._total_frame_ms += elapsed_ms
+            busy = self._pending or not self._incoming.empty()
+            self._root.after(UI_FRAME_INTERVAL_MS if busy else UI_IDLE_INTERVAL_MS, self._drain)
+
+    def queue_depth(self):
+        """Updates waiting to be applied (after coalescing) plus those not yet collected."""
+        return self._incoming.qsize() + sum(len(ops) for ops in self._pending.values())
+
+    def metrics(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "posted": self.posted,
+            "merged": self.merged,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "frames": self.frames,
+            "last_frame_ms": self.last_frame_ms,
+            "avg_frame_ms": self._total_frame_ms / self.frames if self.frames else 0.0,
+            "max_frame_ms": self.max_frame_ms,
+        }
+
+def _apply_append(side, text):
+    """Add streamed text to a pane."""
+    if side not in panes:
+        return  # Pane was removed while its generation was running
+    # The streamed text lives in the pane's buffer
+    panes[side]["view"].append(text)
+
+def _apply_reset(side, text):
+    """Start a pane over with `text` as the beginning of a new stream."""
+    if side not in panes:
+        return
+    show_formatted[side] = True
+    panes[side]["button"].config(text="Show Raw")
+    panes[side]["view"].set_text(text or "")
+
+def _apply_set(side, payload):
+    """Show a finished answer (formatted) or an error (plain) in a pane."""
+    if side not in panes:
+        return
+    message, error = payload
+    _set_widget_message(panes[side]["text"], message, side=side, error=error)
+
+COMPARISON_KEY = "comparison"  # UIDispatcher side for comparison bar updates
+
+def describe_comparison(result, final, labels):
+    """A compare_outputs() result as a few lines for the comparison bar."""
+    lines = []
+    for pair in result["pairs"]:
+        parts = [
+            f"{labels[pair['other']]} vs {labels[pair['base']]}: {pair['similarity']:.0%} similar",
+            f"+{pair['inserted']} -{pair['deleted']} ~{pair['replaced']} tokens",
+        ]
+        for key, name in (("length_ratio", "length"), ("latency_ratio", "latency"), ("ttft_ratio", "ttft")):
+            if pair[key] is not None:
+                parts.append(f"{name} {pair[key]:.2f}x")
+        lines.append(", ".join(parts))
+    names = dict.fromkeys(name for scores in result["scores"].values() for name in scores)
+    for name in names:
+        scored = [(labels[key], scores[name]) for key, scores in result["scores"].items() if scores.get(name) is not None]
+        if scored:
+            lines.append(f"{name}: " + "  ".join(f"{label} {score:.2f}" for label, score in scored))
+    if result.get("failed"):
+        lines.append("Not compared (no answer): " + ", ".join(labels[key] for key in result["failed"]))
+    if not final and lines:
+        lines[0] = "(streaming) " + lines[0]
+    return "\n".join(lines)
+
+def _apply_comparison(side, payload):
+    comparison_var.set(describe_comparison(*payload))
+
+def _observe_render(side, seconds):
+    # Credit the model that produced the output, not whatever the dropdown shows now
+    if side in render_models:
+        metrics.observe(render_models[side], "render", seconds)
+
+ui = UIDispatcher({"append": _apply_append, "reset": _apply_reset, "set": _apply_set, "compare": _apply_comparison}, on_render=_observe_render)
+
+class StoredResponseRejected(Exception):
+    """LM Studio no longer has the response a conversation turn continues from."""
+
+def generate_for_model(model_name, prompt_text, side, expected_model_id, cancel_event=None, cache_mode=None, generation=None, previous_response_id=None, context_note=None, comparator=None):
+    """Generate text for a single model and stream it into the UI.
+
+    Runs in a GenerationEngine pool thread. Errors are shown in the pane;
+    GenerationCancelled propagates so the engine can report the cancellation.
+    UI updates are tagged with `generation` (from ui.begin) so they are
+    dropped once a newer prompt has taken over the pane. In a conversation,
+    `previous_response_id` continues a stored response and `context_note`
+    is shown under the answer; if the server rejects it with a 4xx,
+    StoredResponseRejected is raised right away so the caller can replay
+    the history instead of going through recovery. The request goes to the host `endpoints`
+    picks, and the recovery retry fails over to another host if there is one.
+    The streamed answer is also fed to `comparator` under `side`.
+
+    Returns:
+        tuple: (generated_text, model_instance_id, stats, ttft), all None on error.
+    """
+    import requests
+    failed = (None, None, None, None)
+    shown = {"kind": None, "cached": False}
+
+    def on_delta(kind, text):
+        if kind == "cached":
+            shown["cached"] = True
             return
+        # Start a fresh pane whenever the stream switches between reasoning and the answer
+        if kind != shown["kind"]:
+            shown["kind"] = kind
+            if comparator:
+                comparator.reset(side)
+            ui.post("reset", side, "Thinking...\n\n" if kind == "reasoning" else "", generation)
+        ui.post("append", side, text, generation)
+        if comparator and kind == "message":
+            comparator.append(side, text)
+
+    def show(message, error=False):
+        ui.post("set", side, (message, error), generation)
+
+    # Send the prompt immediately (fast path) and only pivot to loading/unloading on error
+    endpoint = endpoints.pick(model_name, previous_response_id=previous_response_id)
+    try:
+        with endpoint.warm_pool.using(model_name):
+            generated_text, model_id, stats, ttft = stream_generate(model_name, prompt_text, on_delta, cancel_event=cancel_event, cache_mode=cache_mode, previous_response_id=previous_response_id, endpoint=endpoint)
+    except (requests.exceptions.RequestException, ValueError) as first_err:
+        response = getattr(first_err, "response", None)
+        if previous_response_id and response is not None and 400 <= response.status_code < 500:
+            # The server rejected the stored response; loading or failing over won't help, the caller replays the history
+            print(f"{model_name} on {endpoint.url} rejected previous_response_id {previous_response_id}: {first_err}")
+            show("Stored conversation unavailable, resending the history...")
+            raise StoredResponseRejected(str(first_err))
+
+        # First attempt failed; pivot to ensure model is loaded and remove duplicates, then retry
+        print(f"Initial request failed for {model_name} on {endpoint.url}: {first_err}. Pivoting to load/unload flow.")
+
+        try:
+            # Fail over to another host when there is one, then ensure the model is loaded there
+            # (loads it and removes duplicates once if missing)
+            recovery_start = time.perf_counter()
+            endpoint = endpoints.pick(model_name, exclude=(endpoint,))
+            endpoints.ensure(endpoint, model_name, side)
+            metrics.observe(model_name, "recovery", time.perf_counter() - recovery_start)
+
+            # Try one more time after recovery steps
+            shown["kind"] = None
+            with endpoint.warm_pool.using(model_name):
+                generated_text, model_id, stats, ttft = stream_generate(model_name, prompt_text, on_delta, cancel_event=cancel_event, cache_mode=cache_mode, previous_response_id=previous_response_id, endpoint=endpoint)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"Recovery failed for {model_name}: {e}")
+            show(f"Error after recovery attempt: {e}", error=True)
+            return failed
 
     # At this point we have generated_text/model_id (or generated_text may be None)
     # Verify the response came from the correct model
     if model_id != expected_model_id:
         msg = f"Error: Response mismatch. Expected {expected_model_id}, got {model_id}"
         print(f"Warning: Response for {side} came from {model_id}, expected {expected_model_id}")
-        _set_widget_message(text_widget, msg, side=side, error=True)
-        return
+        show(msg, error=True)
+        return failed
 
     if generated_text:
-        # Append stats if available
+        # Append time to first token and stats if available
         try:
+            display_text = generated_text
+            if shown["cached"]:
+                display_text = "*⚡ Cached response*\n\n" + display_text
+            if ttft is not None:
+                display_text += f"\n\n**Time to first token**: {ttft:.2f} s"
+            if context_note:
+                display_text += f"\n\n**Context**: {context_note}"
             if stats:
-                stats_block = "\n\n**Stats**:\n```json\n" + json.dumps(stats, indent=2) + "\n```\n"
-                display_text = (generated_text or "") + stats_block
-            else:
-                display_text = generated_text
+                display_text += "\n\n**Stats**:\n```json\n" + json.dumps(stats, indent=2) + "\n```\n"
         except Exception:
             display_text = generated_text
 
-        _set_widget_message(text_widget, display_text, side=side, error=False)
-    else:
-        _set_widget_message(text_widget, f"Error: No response from {model_name}", side=side, error=True)
+        show(display_text)
+        return generated_text, model_id, stats, ttft
 
-def on_dropdown_left_change(value):
-    """Handle left dropdown selection."""
-    selected_models["left"] = available_models.index(dropdown_left_var.get())
+    show(f"Error: No response from {model_name}", error=True)
+    return failed
 
-def on_dropdown_right_change(value):
-    """Handle right dropdown selection."""
-    selected_models["right"] = available_models.index(dropdown_right_var.get())
+def pin_selected_models():
+    """Keep the models selected in the panes safe from warm pool eviction."""
+    endpoints.pin(available_models[selected_models[side]] for side in panes if side in selected_models)
 
-def main(event=None):
-    model1_name = available_models[selected_models["left"]]
-    model2_name = available_models[selected_models["right"]]
-    
+def on_dropdown_change(side, value):
+    """Handle a pane's model selection and start loading it right away."""
+    selected_models[side] = available_models.index(value)
+    pin_selected_models()
+    endpoints.preload(value)
+
+async def _collect_results(prompt_text, targets, expected_ids, cache_mode, generations, plans, comparator):
+    """Run one prompt through the engine for every pane and log each result.
+
+    Panes with a conversation plan in `plans` send that turn instead of the
+    bare prompt and record the reply in their session. Every pane's output
+    goes to `comparator` as it streams and once it is finished.
+    """
+    def worker(side, model_name, prompt, cancel_event):
+        plan = plans.get(side)
+        if plan is None:
+            return generate_for_model(model_name, prompt, side, expected_ids[side], cancel_event, cache_mode, generations[side], comparator=comparator)
+
+        def send(plan):
+            return generate_for_model(model_name, plan["input"], side, expected_ids[side], cancel_event, cache_mode, generations[side],
+                                      plan["previous_response_id"], ConversationSession.describe(plan), comparator)
+
+        try:
+            result = send(plan)
+        except StoredResponseRejected:
+            # LM Studio no longer has the stored response; resend the history instead
+            plan = ConversationSession.replay(plan)
+            result = send(plan)
+        if result[0] is not None:
+            plan["session"].record(plan, result[0], result[2])
+        return result
+
+    async for result in engine.fan_out(prompt_text, targets, worker=worker):
+        side = result["key"]
+        if result["cancelled"] or result["error"] or result["text"] is None:
+            comparator.fail(side)
+        else:
+            comparator.finish(side, result["text"], result["elapsed"], result["ttft"])
+        if result["cancelled"]:
+            ui.post("set", side, ("Cancelled.", True), generations[side])
+        elif result["error"]:
+            ui.post("set", side, (f"Error: {result['error']}", True), generations[side])
+        if not result["cancelled"]:
+            results_store.append(prompt_text, result["model"], result["text"], model_id=result["model_id"], stats=result["stats"],
+                                 side=side, ttft=result["ttft"], queue_wait=result.get("queue_wait"), elapsed=result["elapsed"],
+                                 error=result["error"] or (None if result["text"] is not None else "No response"))
+        print(f"{result['model']} ({side}) finished in {result['elapsed']:.2f} s")
+
+def on_generate(event=None):
+    """Generate button: send the prompt to every pane's model."""
+    import asyncio
+    global comparator
     prompt_text = prompt_entry.get(1.0, tk.END).strip()
     if not prompt_text:
         print("Please enter a prompt")
         return
     
+    # A new generation per pane; anything still arriving for the previous prompt is dropped
+    generations = {side: ui.begin(side) for side in panes}
+
     # Clear previous outputs
-    text_left.config(state=tk.NORMAL)
-    text_right.config(state=tk.NORMAL)
-    text_left.delete(1.0, tk.END)
-    text_right.delete(1.0, tk.END)
-    text_left.insert(tk.END, "Generating...\n")
-    text_right.insert(tk.END, "Generating...\n")
-    text_left.config(state=tk.DISABLED)
-    text_right.config(state=tk.DISABLED)
+    for side in panes:
+        _show_plain(side, "Generating...\n")
     
     # Clear input field
     prompt_entry.delete(1.0, tk.END)
     
     # Do not pre-check or load models here — workers will send the prompt
     # immediately and only pivot to loading/unloading on errors.
-    model1_id = model_instances["left"] or model1_name
-    model2_id = model_instances["right"] or model2_name
-    
-    # Create threads for both LLMs to run simultaneously
-    thread1 = threading.Thread(target=generate_for_model, args=(model1_name, prompt_text, text_left, "left", model1_id))
-    thread2 = threading.Thread(target=generate_for_model, args=(model2_name, prompt_text, text_right, "right", model2_id))
+    targets = [(side, available_models[selected_models[side]]) for side in panes]
+    expected_ids = {side: endpoints.instance_for(side) or model_name for side, model_name in targets}
+    render_models.update(targets)
+
+    # In a conversation each pane continues its own history with its model
+    plans = {}
+    if conversation_var.get():
+        for side, model_name in targets:
+            if side not in sessions or sessions[side].model_name != model_name:
+                sessions[side] = ConversationSession(model_name)
+            plans[side] = sessions[side].prepare(prompt_text)
     
-    thread1.start()
-    thread2.start()
-
-root = tk.Tk()
-root.title("Dual LLM Text Generation")
-root.minsize(600, 600)
-root.maxsize(1980, 1080)
-root.geometry("1000x700+50+50")
-root.config(bg=BG_COLOR)
-
-# Input section
-input_frame = tk.Frame(root, bg=BG_COLOR)
-input_frame.pack(fill=tk.BOTH, padx=10, pady=10)
-
-tk.Label(input_frame, text="Enter your prompt: ", bg=BG_COLOR, fg=FG_COLOR).pack(anchor=tk.NW)
-prompt_entry = scrolledtext.ScrolledText(input_frame, wrap=tk.WORD, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, height=6, relief=tk.FLAT, bd=8)
-prompt_entry.pack(fill=tk.BOTH, expand=True, pady=(5, 10))
-prompt_entry.bind("<Control-Return>", main)
-
-generate_button = tk.Button(input_frame, text="Generate Text", command=main, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
-generate_button.pack()
-
-# Model selection and output section
-content_frame = tk.Frame(root, bg=BG_COLOR)
-content_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-# Configure equal weights for left and right frames
-content_frame.grid_columnconfigure(0, weight=1)
-content_frame.grid_columnconfigure(1, weight=1)
-content_frame.grid_rowconfigure(0, weight=1)
-
-# Left side
-left_frame = tk.Frame(content_frame, bg=BG_COLOR)
-left_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 5))
-
-tk.Label(left_frame, text="Select Model (Left):", bg=BG_COLOR, fg=FG_COLOR).pack(anchor=tk.NW)
-dropdown_left_var = tk.StringVar(value=available_models[2])
-dropdown_left = tk.OptionMenu(left_frame, dropdown_left_var, *available_models, command=on_dropdown_left_change)
-dropdown_left.config(bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", activeforeground=BUTTON_FG, relief=tk.FLAT, bd=0, highlightthickness=0, padx=8, pady=6)
-dropdown_left.pack(fill=tk.X, pady=(0, 10))
-selected_models["left"] = 2
-
-left_output_frame = tk.Frame(left_frame, bg=BG_COLOR)
-left_output_frame.pack(fill=tk.BOTH, expand=True)
-
-left_header = tk.Frame(left_output_frame, bg=BG_COLOR)
-left_header.pack(fill=tk.X, pady=(0, 5))
-tk.Label(left_header, text="Output", font=("Arial", 10, "bold"), bg=BG_COLOR, fg=FG_COLOR).pack(side=tk.LEFT)
-button_left = tk.Button(left_header, text="Show Raw", command=lambda: toggle_view("left"), bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", font=("Arial", 9), relief=tk.FLAT, bd=0, padx=12, pady=4)
-button_left.pack(side=tk.RIGHT)
-
-text_left = scrolledtext.ScrolledText(left_output_frame, wrap=tk.WORD, state=tk.DISABLED, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, relief=tk.FLAT, bd=8)
-text_left.pack(fill=tk.BOTH, expand=True)
-
-# Right side
-right_frame = tk.Frame(content_frame, bg=BG_COLOR)
-right_frame.grid(row=0, column=1, sticky="nsew", padx=(5, 0))
-
-tk.Label(right_frame, text="Select Model (Right):", bg=BG_COLOR, fg=FG_COLOR).pack(anchor=tk.NW)
-dropdown_right_var = tk.StringVar(value=available_models[1])
-dropdown_right = tk.OptionMenu(right_frame, dropdown_right_var, *available_models, command=on_dropdown_right_change)
-dropdown_right.config(bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", activeforeground=BUTTON_FG, relief=tk.FLAT, bd=0, highlightthickness=0, padx=8, pady=6)
-dropdown_right.pack(fill=tk.X, pady=(0, 10))
-selected_models["right"] = 1
-
-right_output_frame = tk.Frame(right_frame, bg=BG_COLOR)
-right_output_frame.pack(fill=tk.BOTH, expand=True)
-
-right_header = tk.Frame(right_output_frame, bg=BG_COLOR)
-right_header.pack(fill=tk.X, pady=(0, 5))
-tk.Label(right_header, text="Output", font=("Arial", 10, "bold"), bg=BG_COLOR, fg=FG_COLOR).pack(side=tk.LEFT)
-button_right = tk.Button(right_header, text="Show Raw", command=lambda: toggle_view("right"), bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", font=("Arial", 9), relief=tk.FLAT, bd=0, padx=12, pady=4)
-button_right.pack(side=tk.RIGHT)
-
-text_right = scrolledtext.ScrolledText(right_output_frame, wrap=tk.WORD, state=tk.DISABLED, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, relief=tk.FLAT, bd=8)
-text_right.pack(fill=tk.BOTH, expand=True)
-
-root.mainloop()
+    # The outputs are diffed and scored in worker processes while they stream
+    if comparator is not None:
+        comparator.close()
+    labels = {side: model_name.split("/")[-1] for side, model_name in targets}
+    comparison_generation = ui.begin(COMPARISON_KEY)
+    comparator = Comparator(list(labels), lambda result, final: ui.post("compare", COMPARISON_KEY, (result, final, labels), comparison_generation))
+    comparison_var.set("")
+
+    # Every pane's model runs at once on the engine's event loop; jobs still
+    # running for the previous prompt are cancelled when these start
+    cache_mode = "on" if use_cache_var.get() else CACHE_MODE  # Sampled answers are only reused when asked for
+    asyncio.run_coroutine_threadsafe(_collect_results(prompt_text, targets, expected_ids, cache_mode, generations, plans, comparator), engine_loop)
+
+def new_chat():
+    """Forget every pane's conversation; the next prompt starts fresh."""
+    sessions.clear()
+
+def stop_pane(side):
+    """Cancel the generation running in a pane."""
+    engine.cancel(side)
+
+def add_pane(side=None, model_index=0):
+    """Add an output pane with its own model selector; up to MAX_PANES."""
+    if len(panes) >= MAX_PANES:
+        print(f"At most {MAX_PANES} models can be compared at once")
+        return None
+    if side is None:
+        number = len(panes) + 1
+        while f"pane{number}" in panes:
+            number += 1
+        side = f"pane{number}"
+
+    column = len(panes)
+    content_frame.grid_columnconfigure(column, weight=1, uniform="panes")
+
+    frame = tk.Frame(content_frame, bg=BG_COLOR)
+    frame.grid(row=0, column=column, sticky="nsew", padx=5)
+
+    title = side.capitalize() if side in ("left", "right") else f"Model {column + 1}"
+    tk.Label(frame, text=f"Select Model ({title}):", bg=BG_COLOR, fg=FG_COLOR).pack(anchor=tk.NW)
+    var = tk.StringVar(value=available_models[model_index])
+    dropdown = tk.OptionMenu(frame, var, *available_models, command=lambda value: on_dropdown_change(side, value))
+    dropdown.config(bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", activeforeground=BUTTON_FG, relief=tk.FLAT, bd=0, highlightthickness=0, padx=8, pady=6)
+    dropdown.pack(fill=tk.X, pady=(0, 10))
+
+    output_frame = tk.Frame(frame, bg=BG_COLOR)
+    output_frame.pack(fill=tk.BOTH, expand=True)
+
+    header = tk.Frame(output_frame, bg=BG_COLOR)
+    header.pack(fill=tk.X, pady=(0, 5))
+    tk.Label(header, text="Output", font=("Arial", 10, "bold"), bg=BG_COLOR, fg=FG_COLOR).pack(side=tk.LEFT)
+    button = tk.Button(header, text="Show Raw", command=lambda: toggle_view(side), bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", font=("Arial", 9), relief=tk.FLAT, bd=0, padx=12, pady=4)
+    button.pack(side=tk.RIGHT)
+    tk.Button(header, text="Stop", command=lambda: stop_pane(side), bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", font=("Arial", 9), relief=tk.FLAT, bd=0, padx=12, pady=4).pack(side=tk.RIGHT, padx=(0, 5))
+    if side not in ("left", "right"):
+        tk.Button(header, text="Remove", command=lambda: remove_pane(side), bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", font=("Arial", 9), relief=tk.FLAT, bd=0, padx=12, pady=4).pack(side=tk.RIGHT, padx=(0, 5))
+
+    view = VirtualOutput(output_frame, wrap=tk.WORD, state=tk.DISABLED, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, relief=tk.FLAT, bd=8)
+    view.frame.pack(fill=tk.BOTH, expand=True)
+
+    panes[side] = {"frame": frame, "text": view.text_widget, "button": button, "var": var, "view": view}
+    selected_models[side] = model_index
+    show_formatted[side] = True
+    pin_selected_models()
+    return side
+
+def remove_pane(side):
+    """Remove an extra pane, cancelling its generation."""
+    engine.cancel(side)
+    pane = panes.pop(side)
+    pane["frame"].destroy()
+    for store in (selected_models, render_models, show_formatted, sessions):
+        store.pop(side, None)
+    pin_selected_models()
+
+    # Close the gap left in the grid
+    for column, remaining in enumerate(panes.values()):
+        remaining["frame"].grid(row=0, column=column)
+    content_frame.grid_columnconfigure(len(panes), weight=0, uniform="")
+
+METRICS_EXPORT_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+
+def _format_model_stats(model_name, model_metrics):
+    """One compact stats-bar entry, e.g. "gpt-oss-20b  ttft 0.8s  42 tok/s  p95 12.3s"."""
+    parts = [model_name.split("/")[-1]]
+    if "ttft" in model_metrics:
+        parts.append(f"ttft {model_metrics['ttft']['p50']:.2f}s")
+    if "tokens_per_second" in model_metrics:
+        parts.append(f"{model_metrics['tokens_per_second']['p50']:.0f} tok/s")
+    if "total_latency" in model_metrics:
+        latency = model_metrics["total_latency"]
+        parts.append(f"p50 {latency['p50']:.1f}s p95 {latency['p95']:.1f}s")
+    return "  ".join(parts)
+
+def update_status_bar():
+    """Refresh the status and per-model stats lines once a second."""
+    m = ui.metrics()
+    status = f"UI queue: {m['queue_depth']}  |  frame: {m['last_frame_ms']:.1f} ms (avg {m['avg_frame_ms']:.1f}, max {m['max_frame_ms']:.1f})"
+    hosts = endpoints.status()
+    if len(hosts) > 1:
+        status += "  |  hosts: " + "  ".join(f"{url.split('//')[-1]} {'up' if healthy else 'down'} ({in_flight}/{limit})" for url, healthy, in_flight, limit in hosts)
+    else:
+        status += f"  |  concurrency: {hosts[0][2]}/{hosts[0][3]}"
+    connections = endpoints.connection_stats()
+    status += f"  |  connections: {connections['new_connections']} new, {connections['reused_connections']} reused"
+    status_var.set(status)
+    summary = metrics.summary()
+    stats_var.set("   |   ".join(_format_model_stats(model_name, summary[model_name]) for model_name in sorted(summary)))
+    root.after(1000, update_status_bar)
+
+def export_metrics():
+    """Write the per-model metrics as Prometheus text and CSV next to the script."""
+    metrics.export_prometheus(METRICS_EXPORT_BASE + ".prom")
+    metrics.export_csv(METRICS_EXPORT_BASE + ".csv")
+    print(f"Metrics written to {METRICS_EXPORT_BASE}.prom and {METRICS_EXPORT_BASE}.csv")
+
+HISTORY_SEARCH_DELAY_MS = 300  # Typing pause before the history search runs
+HISTORY_FLUSH_POLL_MS = 50  # How often an opening history window checks whether queued rows are written
+HISTORY_FLUSH_WAIT = 5.0  # Seconds after which it reloads with whatever is written
+
+class HistoryPanel:
+    """A window listing past generations from the ResultsStore.
+
+    Rows are fetched RESULTS_PAGE_SIZE at a time, newest first, and the next
+    page is only loaded when the list is scrolled to its end. The search box
+    runs a full-text search over prompts and outputs once typing pauses, and
+    the model menu narrows the list to one model. Selecting a row shows its
+    prompt, output and stats below.
+    """
+
+    ALL_MODELS = "All models"
+
+    def __init__(self, parent, store):
+        self.store = store
+        self.window = tk.Toplevel(parent, bg=BG_COLOR)
+        self.window.title("History")
+        self.window.geometry("900x600")
+        self.ids = []  # Row id per listbox line
+        self.exhausted = False
+        self._search_job = None
+        self._load_pending = False
+
+        controls = tk.Frame(self.window, bg=BG_COLOR)
+        controls.pack(fill=tk.X, padx=10, pady=(10, 5))
+        tk.Label(controls, text="Search: ", bg=BG_COLOR, fg=FG_COLOR).pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = tk.Entry(controls, textvariable=self.search_var, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, relief=tk.FLAT)
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=4)
+        search_entry.bind("<KeyRelease>", self._on_search_key)
+        self.model_var = tk.StringVar(value=self.ALL_MODELS)
+        model_menu = tk.OptionMenu(controls, self.model_var, self.ALL_MODELS, *store.models(), command=lambda value: self.reload())
+        model_menu.config(bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT)
+        model_menu.pack(side=tk.LEFT, padx=(10, 0))
+        self.count_var = tk.StringVar(value="")
+        tk.Label(controls, textvariable=self.count_var, bg=BG_COLOR, fg="#888888").pack(side=tk.LEFT, padx=(10, 0))
+
+        list_frame = tk.Frame(self.window, bg=BG_COLOR)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        scrollbar = tk.Scrollbar(list_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(list_frame, bg=TEXT_BG, fg=TEXT_FG, selectbackground=BUTTON_COLOR, relief=tk.FLAT,
+                                  font=("Courier", 9), activestyle=tk.NONE, exportselection=False, height=12,
+                                  yscrollcommand=lambda lo, hi: self._on_list_scroll(scrollbar, lo, hi))
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.config(command=self.listbox.yview)
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+
+        self.detail = VirtualOutput(self.window, wrap=tk.WORD, state=tk.DISABLED, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, relief=tk.FLAT, bd=8, height=14)
+        self.detail.frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.reload()
+
+    def _filters(self):
+        model_name = self.model_var.get()
+        return self.search_var.get().strip(), None if model_name == self.ALL_MODELS else model_name
+
+    def reload(self):
+        """Start the list over from the newest row with the current filters."""
+        self.listbox.delete(0, tk.END)
+        self.ids = []
+        self.exhausted = False
+        self.load_more()
+        search, model_name = self._filters()
+        self.count_var.set(f"{self.store.count()} saved" if not search and not model_name else "")
+
+    def load_more(self):
+        """Append the next page of rows to the list."""
+        if self.exhausted:
+            return
+        search, model_name = self._filters()
+        try:
+            rows = self.store.page(search, model_name, before_id=self.ids[-1] if self.ids else None)
+        except sqlite3.Error as e:
+            print(f"Error reading history: {e}")
+            rows = []
+        for row_id, created, model, side, preview, elapsed, error in rows:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            status = "error" if error else f"{elapsed:.1f}s" if elapsed is not None else ""
+            self.listbox.insert(tk.END, f"{when}  {model.split('/')[-1][:24]:24}  {status:>7}  {preview}")
+            self.ids.append(row_id)
+        self.exhausted = len(rows) < RESULTS_PAGE_SIZE
+
+    def _on_list_scroll(self, scrollbar, lo, hi):
+        scrollbar.set(lo, hi)
+        if float(hi) >= 1.0 and not self.exhausted and not self._load_pending:
+            self._load_pending = True
+            self.window.after_idle(self._load_next)
+
+    def _load_next(self):
+        self._load_pending = False
+        self.load_more()
+
+    def _on_search_key(self, event=None):
+        if self._search_job is not None:
+            self.window.after_cancel(self._search_job)
+        self._search_job = self.window.after(HISTORY_SEARCH_DELAY_MS, self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        self.reload()
+
+    def _on_select(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        row = self.store.get(self.ids[selection[0]])
+        if row is None:
+            return
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["created"]))
+        content = f"## {row['model']}\n{when}"
+        if row["elapsed"] is not None:
+            content += f", {row['elapsed']:.2f} s"
+        content += f"\n\n**Prompt**:\n{row['prompt']}\n\n---\n"
+        content += f"**Error**: {row['error']}\n" if row["error"] else ""
+        content += row["output"] or ""
+        if row["ttft"] is not None:
+            content += f"\n\n**Time to first token**: {row['ttft']:.2f} s"
+        if row["stats"]:
+            content += "\n\n**Stats**:\n```json\n" + json.dumps(row["stats"], indent=2) + "\n```\n"
+        self.detail.set_text(content)
+
+history_panel = None
+
+def open_history():
+    """Show the history window, reusing it if it's already open."""
+    global history_panel
+    written = results_store.flush(timeout=0)  # Rows still queued are listed once the writer has committed them
+    if history_panel is not None and history_panel.window.winfo_exists():
+        history_panel.window.deiconify()
+        history_panel.window.lift()
+    else:
+        history_panel = HistoryPanel(root, results_store)
+        if written.is_set():
+            return
+    _reload_history_when_written(written, time.perf_counter() + HISTORY_FLUSH_WAIT)
+
+def _reload_history_when_written(written, deadline):
+    """Reload the history panel once `written` is set, polling from the Tk loop instead of blocking it."""
+    if not written.is_set() and time.perf_counter() < deadline:
+        root.after(HISTORY_FLUSH_POLL_MS, _reload_history_when_written, written, deadline)
+        return
+    if history_panel is not None and history_panel.window.winfo_exists():
+        history_panel.reload()
+
+MAX_PANES = 6  # Models that can be compared side by side
+
+panes = {}  # side -> {"frame", "text", "button", "var", "view"}
+sessions = {}  # side -> ConversationSession while "Conversation" is ticked
+comparator = None  # Comparator for the latest prompt
+engine = GenerationEngine()
+
+def build_window():
+    """Create the main window with its panes and return the Tk root."""
+    global root, prompt_entry, use_cache_var, conversation_var, content_frame, comparison_var, stats_var, status_var
+    root = tk.Tk()
+    root.title("Dual LLM Text Generation")
+    root.minsize(600, 600)
+    root.maxsize(1980, 1080)
+    root.geometry("1000x700+50+50")
+    root.config(bg=BG_COLOR)
+
+    # Input section
+    input_frame = tk.Frame(root, bg=BG_COLOR)
+    input_frame.pack(fill=tk.BOTH, padx=10, pady=10)
+
+    tk.Label(input_frame, text="Enter your prompt: ", bg=BG_COLOR, fg=FG_COLOR).pack(anchor=tk.NW)
+    prompt_entry = scrolledtext.ScrolledText(input_frame, wrap=tk.WORD, bg=TEXT_BG, fg=TEXT_FG, insertbackground=FG_COLOR, height=6, relief=tk.FLAT, bd=8)
+    prompt_entry.pack(fill=tk.BOTH, expand=True, pady=(5, 10))
+    prompt_entry.bind("<Control-Return>", on_generate)
+
+    button_row = tk.Frame(input_frame, bg=BG_COLOR)
+    button_row.pack()
+    generate_button = tk.Button(button_row, text="Generate Text", command=on_generate, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
+    generate_button.pack(side=tk.LEFT)
+    add_pane_button = tk.Button(button_row, text="Add Model", command=add_pane, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
+    add_pane_button.pack(side=tk.LEFT, padx=(10, 0))
+    export_metrics_button = tk.Button(button_row, text="Export Metrics", command=export_metrics, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
+    export_metrics_button.pack(side=tk.LEFT, padx=(10, 0))
+    use_cache_var = tk.BooleanVar(value=CACHE_MODE == "on")
+    tk.Checkbutton(button_row, text="Cache sampled answers", variable=use_cache_var, bg=BG_COLOR, fg=FG_COLOR, selectcolor=TEXT_BG, activebackground=BG_COLOR, activeforeground=FG_COLOR).pack(side=tk.LEFT, padx=(10, 0))
+    conversation_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(button_row, text="Conversation", variable=conversation_var, bg=BG_COLOR, fg=FG_COLOR, selectcolor=TEXT_BG, activebackground=BG_COLOR, activeforeground=FG_COLOR).pack(side=tk.LEFT, padx=(10, 0))
+    new_chat_button = tk.Button(button_row, text="New Chat", command=new_chat, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
+    new_chat_button.pack(side=tk.LEFT, padx=(10, 0))
+    history_button = tk.Button(button_row, text="History", command=open_history, bg=BUTTON_COLOR, fg=BUTTON_FG, activebackground="#1565c0", relief=tk.FLAT, bd=0, padx=16, pady=8)
+    history_button.pack(side=tk.LEFT, padx=(10, 0))
+
+    # Model selection and output section
+    content_frame = tk.Frame(root, bg=BG_COLOR)
+    content_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    content_frame.grid_rowconfigure(0, weight=1)
+
+    # gpt-oss and deepseek with the default models; the config file may list fewer
+    add_pane("left", model_index=min(2, len(available_models) - 1))
+    add_pane("right", model_index=min(1, len(available_models) - 1))
+
+    comparison_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=comparison_var, anchor=tk.W, justify=tk.LEFT, bg=BG_COLOR, fg=HEADING_FG, font=("Courier", 9)).pack(fill=tk.X, padx=10)
+    stats_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=stats_var, anchor=tk.W, bg=BG_COLOR, fg=FG_COLOR, font=("Courier", 9)).pack(fill=tk.X, padx=10)
+    status_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=status_var, anchor=tk.W, bg=BG_COLOR, fg="#888888", font=("Arial", 8)).pack(fill=tk.X, padx=10, pady=(0, 4))
+
+    ui.start(root)
+    update_status_bar()
+    return root
+
+def main(argv=None):
+    """Run batch mode when given arguments, otherwise open the window."""
+    global engine_loop
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        # Command-line arguments mean a headless batch run; no window is created
+        return batch_main(argv)
+
+    build_window()
+    engine_loop = start_background_loop()
+    if WARM_POOL_PRELOAD_ON_START:
+        for model_name in dict.fromkeys(available_models[index] for index in selected_models.values()):
+            endpoints.preload(model_name)
+    root.after_idle(lambda: print(f"Window ready {(time.perf_counter() - STARTED) * 1000:.0f} ms after launch"))
+    root.mainloop()
+    engine.cancel_all()  # Aborts open streams so LM Studio doesn't keep generating for a closed window
+    results_store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
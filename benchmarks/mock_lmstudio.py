@@ -0,0 +1,316 @@
+"""Local stand-in for the LM Studio REST API.
+
+Implements just enough of /api/v1/models, /api/v1/models/load,
+/api/v1/models/unload and /api/v1/chat (JSON and server-sent events) to
+measure the client without a GPU. Latency, token rate, streaming and failures
+are all configurable, so the same server can be used by the benchmarks and
+by hand:
+
+    python benchmarks/mock_lmstudio.py --port 1234 --token-rate 40
+    LMSTUDIO_BASE_URL=http://127.0.0.1:1234 python "ai apis.py"
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ("google/gemma-3-12b", "deepseek/deepseek-r1-0528-qwen3-8b", "openai/gpt-oss-20b")
+MODEL_SIZE_BYTES = 8 * 1024 ** 3  # Reported as size_bytes for every loaded model
+
+# Cycled to build responses; includes markdown so the renderer has work to do
+RESPONSE_WORDS = (
+    "The", "**quick**", "brown", "fox", "jumps", "over", "the", "*lazy*", "dog", "and", "`runs`", "away.\n",
+    "## Notes\n", "- first", "point\n", "- second", "point\n", "```\n", "code", "block\n", "```\n",
+)
+
+class MockLMStudio:
+    """A threaded HTTP server that answers like LM Studio.
+
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port to listen on; 0 picks a free one.
+        latency (float): Seconds before the first byte of every chat answer.
+        token_rate (float): Tokens per second while generating; 0 means as fast as possible.
+        shared_rate (bool): Split token_rate between the chats generating at once, like one GPU serving them all.
+        tokens (int): Tokens in every chat answer, fewer if the request sets max_output_tokens.
+        stream (bool): Answer {"stream": true} requests with server-sent events.
+        failure_rate (float): Fraction of chat requests answered with HTTP 500.
+        load_latency (float): Seconds a model load takes.
+        require_loaded (bool): Answer chat requests for unloaded models with HTTP 404.
+        models (iterable): Models loaded when the server starts.
+        seed (int, optional): Seed for failure injection.
+        response_ids (bool): Return a response_id and accept previous_response_id, like LM Studio's stored chats.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_rate=0.0, tokens=64, stream=True,
+                 failure_rate=0.0, load_latency=0.0, require_loaded=False, models=DEFAULT_MODELS, seed=None,
+                 response_ids=True, shared_rate=False):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.shared_rate = shared_rate
+        self.generating = 0  # Chats currently producing tokens
+        self.tokens = tokens
+        self.stream = stream
+        self.failure_rate = failure_rate
+        self.load_latency = load_latency
+        self.require_loaded = require_loaded
+        self.response_ids = response_ids
+        self.responses = set()  # Stored response ids
+        self.loaded = list(models)
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._thread = None
+
+        mock = self
+
+        class Handler(_MockHandler):
+            server_state = mock
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-lmstudio", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def should_fail(self):
+        with self._lock:
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def is_loaded(self, model_name):
+        with self._lock:
+            return model_name in self.loaded
+
+    def load(self, model_name):
+        time.sleep(self.load_latency)
+        with self._lock:
+            if model_name not in self.loaded:
+                self.loaded.append(model_name)
+
+    def unload(self, model_name):
+        with self._lock:
+            if model_name not in self.loaded:
+                return False
+            self.loaded.remove(model_name)
+            return True
+
+    def store_response(self):
+        with self._lock:
+            response_id = f"resp_{len(self.responses) + 1}"
+            self.responses.add(response_id)
+            return response_id
+
+    def token_delay(self):
+        """Seconds until a chat's next token."""
+        if not self.token_rate:
+            return 0.0
+        with self._lock:
+            sharing = self.generating if self.shared_rate else 1
+        return max(sharing, 1) / self.token_rate
+
+    def response_tokens(self):
+        tokens = []
+        for i in range(self.tokens):
+            word = RESPONSE_WORDS[i % len(RESPONSE_WORDS)]
+            tokens.append(word if word.endswith("\n") else word + " ")
+        return tokens
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like LM Studio
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json({"error": {"message": message}}, status)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        state = self.server_state
+        if self.path.rstrip("/") != "/api/v1/models":
+            state.count("not_found")
+            self._send_error(404, f"No route for GET {self.path}")
+            return
+        state.count("models")
+        with state._lock:
+            models = [{"id": name, "size_bytes": MODEL_SIZE_BYTES} for name in state.loaded]
+        self._send_json({"data": models})
+
+    def do_POST(self):
+        state = self.server_state
+        body = self._read_json()
+        path = self.path.rstrip("/")
+        model_name = body.get("model") or ""
+
+        if path == "/api/v1/models/load":
+            state.count("load")
+            state.load(model_name)
+            self._send_json({"id": model_name, "status": "loaded"})
+        elif path == "/api/v1/models/unload":
+            state.count("unload")
+            if state.unload(model_name):
+                self._send_json({"id": model_name, "status": "unloaded"})
+            else:
+                self._send_error(404, f"Model {model_name} is not loaded")
+        elif path == "/api/v1/chat":
+            state.count("chat")
+            self._chat(state, body, model_name)
+        else:
+            state.count("not_found")
+            self._send_error(404, f"No route for POST {self.path}")
+
+    def _chat(self, state, body, model_name):
+        if state.require_loaded and not state.is_loaded(model_name):
+            state.count("chat_not_loaded")
+            self._send_error(404, f"Model {model_name} is not loaded")
+            return
+        if state.should_fail():
+            state.count("chat_failed")
+            self._send_error(500, "Injected failure")
+            return
+        previous_response_id = body.get("previous_response_id")
+        if previous_response_id and (not state.response_ids or previous_response_id not in state.responses):
+            state.count("chat_unknown_response")
+            self._send_error(400, f"Unknown previous_response_id {previous_response_id}")
+            return
+        if previous_response_id:
+            state.count("chat_continued")
+        response_id = state.store_response() if state.response_ids else None
+        input_tokens = len(str(body.get("input") or "")) // 4 + 1
+
+        start = time.perf_counter()
+        time.sleep(state.latency)
+        with state._lock:
+            state.generating += 1
+        try:
+            self._generate(state, body, model_name, start, response_id, input_tokens)
+        finally:
+            with state._lock:
+                state.generating -= 1
+
+    def _generate(self, state, body, model_name, start, response_id, input_tokens):
+        tokens = state.response_tokens()[:body.get("max_output_tokens") or None]
+
+        if not (body.get("stream") and state.stream):
+            for _ in tokens if state.token_rate else ():
+                time.sleep(state.token_delay())
+            self._send_json(self._result(model_name, "".join(tokens), len(tokens), start, start, response_id, input_tokens))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._send_event("chat.start", {"type": "chat.start", "model_instance_id": model_name})
+            first_token = None
+            for token in tokens:
+                delay = state.token_delay()
+                if delay:
+                    time.sleep(delay)
+                first_token = first_token or time.perf_counter()
+                self._send_event("message.delta", {"type": "message.delta", "content": token})
+            result = self._result(model_name, "".join(tokens), len(tokens), start, first_token or start, response_id, input_tokens)
+            self._send_event("chat.end", {"type": "chat.end", "result": result})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            state.count("chat_aborted")  # The client cancelled mid-stream
+            self.close_connection = True
+
+    def _send_event(self, name, data):
+        payload = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+    @staticmethod
+    def _result(model_name, text, token_count, start, first_token, response_id, input_tokens):
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        result = {
+            "model_instance_id": model_name,
+            "output": [{"type": "message", "content": text}],
+            "stats": {
+                "input_tokens": input_tokens,
+                "tokens_per_second": round(token_count / elapsed, 2),
+                "time_to_first_token_seconds": round(first_token - start, 4),
+                "total_output_tokens": token_count,
+            },
+        }
+        if response_id:
+            result["response_id"] = response_id
+        return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a mock LM Studio API for benchmarks and manual testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte of a chat answer")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second; 0 for no delay")
+    parser.add_argument("--shared-rate", action="store_true", help="Split the token rate between chats generating at once")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per chat answer")
+    parser.add_argument("--no-stream", action="store_true", help="Always answer chat with plain JSON")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of chat requests answered with HTTP 500")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Seconds a model load takes")
+    parser.add_argument("--require-loaded", action="store_true", help="Reject chat requests for unloaded models")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="Comma-separated models loaded at start")
+    parser.add_argument("--no-response-ids", action="store_true", help="Act like a server without stored responses")
+    args = parser.parse_args(argv)
+
+    mock = MockLMStudio(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        token_rate=args.token_rate,
+        shared_rate=args.shared_rate,
+        tokens=args.tokens,
+        stream=not args.no_stream,
+        failure_rate=args.failure_rate,
+        load_latency=args.load_latency,
+        require_loaded=args.require_loaded,
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        response_ids=not args.no_response_ids,
+    )
+    print(f"Mock LM Studio listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""Benchmarks for the client side of the app, run against a local mock LM Studio.
+
+Measures what this code costs apart from the model: request overhead,
+stream parsing, the load/retry recovery path, markdown rendering, fanning
+one prompt out to several models, the adaptive per-host concurrency limit
+and cold start. Results are compared with a
+stored baseline and the run fails if anything regressed by more than the
+threshold.
+
+    python benchmarks/run_benchmarks.py --save-baseline   # record benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py                   # compare against it
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from mock_lmstudio import MockLMStudio
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BENCH_DIR, os.pardir))
+APP_PATH = os.path.join(REPO_DIR, "ai apis.py")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+REGRESSION_THRESHOLD = 0.20  # Fractional change against the baseline that fails the run
+
+# metric -> "lower" or "higher", whichever is better
+METRIC_DIRECTIONS = {
+    "generate_text_p50_ms": "lower",
+    "generate_text_p95_ms": "lower",
+    "generate_text_requests_per_s": "higher",
+    "generate_text_connection_reuse": "higher",
+    "stream_p50_ms": "lower",
+    "stream_tokens_per_s": "higher",
+    "recovery_p50_ms": "lower",
+    "recovery_overhead_ms": "lower",
+    "parse_markdown_ms": "lower",
+    "parse_markdown_mb_per_s": "higher",
+    "format_markdown_ms": "lower",
+    "renderer_stream_ms": "lower",
+    "view_toggle_ms": "lower",
+    "fanout_wall_ms": "lower",
+    "fanout_tokens_per_s": "higher",
+    "fanout_efficiency": "higher",
+    "adaptive_shared_tokens_per_s": "higher",
+    "adaptive_parallel_tokens_per_s": "higher",
+    "startup_engine_ms": "lower",
+    "startup_gui_import_ms": "lower",
+    "startup_window_ms": "lower",
+}
+
+# Timed by bench_startup, each in a fresh interpreter
+STARTUP_SCRIPTS = {
+    "startup_engine_ms": "import lmstudio_engine",
+    "startup_gui_import_ms": (
+        "import importlib.util\n"
+        "spec = importlib.util.spec_from_file_location('ai_apis', 'ai apis.py')\n"
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+    ),
+    "startup_window_ms": (
+        "import importlib.util\n"
+        "spec = importlib.util.spec_from_file_location('ai_apis', 'ai apis.py')\n"
+        "app = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(app)\n"
+        "app.build_window().update()\n"
+    ),
+}
+
+def load_app(base_url):
+    """Import the engine and "ai apis.py" talking to `base_url`, without opening the window.
+
+    Returns:
+        tuple: (engine module, app module).
+    """
+    os.environ["LMSTUDIO_BASE_URL"] = base_url
+    sys.path.insert(0, REPO_DIR)
+    import lmstudio_engine
+    lmstudio_engine.CACHE_MODE = "off"  # Every request must reach the mock
+    spec = importlib.util.spec_from_file_location("ai_apis", APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return lmstudio_engine, app
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)]
+
+def timed(fn, rounds, warmup=2):
+    """Call fn() `warmup` + `rounds` times and return the measured durations in seconds."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_generate_text(core, app, mock, rounds):
+    """Blocking requests with an instant server: pure client and HTTP overhead."""
+    mock.latency, mock.token_rate, mock.tokens = 0.0, 0.0, 64
+    model = mock.loaded[0]
+    before = core.lm_client.connection_stats()
+    durations = timed(lambda: core.generate_text(model, "Benchmark prompt"), rounds)
+    after = core.lm_client.connection_stats()
+    sent = after["requests"] - before["requests"]
+    return {
+        "generate_text_p50_ms": percentile(durations, 50) * 1000,
+        "generate_text_p95_ms": percentile(durations, 95) * 1000,
+        "generate_text_requests_per_s": len(durations) / sum(durations),
+        # Fraction of requests that went out on an already open keep-alive connection
+        "generate_text_connection_reuse": (after["reused_connections"] - before["reused_connections"]) / sent if sent else 0.0,
+    }
+
+def bench_stream(core, app, mock, rounds):
+    """Long streamed answers with no token delay: SSE parsing throughput."""
+    mock.latency, mock.token_rate, mock.tokens = 0.0, 0.0, 2000
+    model = mock.loaded[0]
+    durations = timed(lambda: core.stream_generate(model, "Benchmark prompt", on_delta=lambda kind, text: None), rounds)
+    return {
+        "stream_p50_ms": percentile(durations, 50) * 1000,
+        "stream_tokens_per_s": mock.tokens / percentile(durations, 50),
+    }
+
+def bench_recovery(core, app, mock, rounds):
+    """generate_for_model when its model isn't loaded: fail, load, remove duplicates, retry."""
+    mock.latency, mock.token_rate, mock.tokens = 0.0, 0.0, 64
+    mock.require_loaded = True
+    model = mock.loaded[0]
+
+    def recover():
+        core.unload_model(model)
+        app.ui = app.UIDispatcher({"append": lambda side, text: None, "reset": lambda side, text: None,
+                                   "set": lambda side, payload: None})  # Nothing drains it headless
+        result = app.generate_for_model(model, "Benchmark prompt", "bench", model)
+        if result[0] is None:
+            raise RuntimeError(f"Recovery benchmark did not get a response from {model}")
+
+    try:
+        durations = timed(recover, rounds)
+        # Same request on a loaded model, to isolate what recovery adds
+        direct = timed(lambda: core.stream_generate(model, "Benchmark prompt"), rounds)
+    finally:
+        mock.require_loaded = False
+    p50 = percentile(durations, 50)
+    return {
+        "recovery_p50_ms": p50 * 1000,
+        "recovery_overhead_ms": (p50 - percentile(direct, 50) - mock.load_latency) * 1000,
+    }
+
+def bench_markdown(core, app, mock, rounds):
+    """Large outputs through the parser and, when a display is available, the Tk widget."""
+    mock.tokens = 50000
+    tokens = mock.response_tokens()
+    content = "".join(tokens)
+    durations = timed(lambda: app.parse_markdown(content), rounds)
+    results = {
+        "parse_markdown_ms": percentile(durations, 50) * 1000,
+        "parse_markdown_mb_per_s": len(content.encode("utf-8")) / 1e6 / percentile(durations, 50),
+    }
+
+    try:
+        root = app.tk.Tk()
+    except app.tk.TclError as e:
+        print(f"Skipping widget benchmarks, Tk is unavailable: {e}", file=sys.stderr)
+        return results
+    try:
+        root.withdraw()
+        widget = app.tk.Text(root)
+        view = app.VirtualOutput(root)
+        view.frame.pack()
+
+        def stream_into_view():
+            view.clear()
+            for token in tokens:
+                view.append(token)
+            root.update_idletasks()
+
+        def toggle_view():
+            view.set_formatted(not view.formatted)
+            root.update_idletasks()
+
+        format_durations = timed(lambda: (app.format_markdown(widget, content), root.update_idletasks()), rounds)
+        stream_durations = timed(stream_into_view, max(rounds // 4, 1), warmup=1)
+        toggle_durations = timed(toggle_view, rounds)
+        results["format_markdown_ms"] = percentile(format_durations, 50) * 1000
+        results["renderer_stream_ms"] = percentile(stream_durations, 50) * 1000
+        results["view_toggle_ms"] = percentile(toggle_durations, 50) * 1000
+    finally:
+        root.destroy()
+    return results
+
+def bench_fanout(core, app, mock, rounds, models=6):
+    """One prompt to `models` models at once with a realistic token rate."""
+    mock.latency, mock.token_rate, mock.tokens = 0.05, 400.0, 100
+    targets = [(f"pane{i}", f"bench/model-{i}") for i in range(models)]
+    engine = core.GenerationEngine(max_concurrency=models)
+    limiter = core.endpoints.endpoints[0].limiter
+    core.endpoints.endpoints[0].limiter = core.AdaptiveLimiter(limiter.name, models, models, adaptive=False)  # bench_adaptive covers the limiter
+
+    def fan_out():
+        results = asyncio.run(engine.run("Benchmark prompt", targets))
+        failed = [r for r in results if r["error"] or not r["text"]]
+        if failed:
+            raise RuntimeError(f"Fan-out benchmark failed: {failed[0]['error']}")
+
+    try:
+        durations = timed(fan_out, max(rounds // 4, 1), warmup=1)
+    finally:
+        engine.executor.shutdown(wait=False)
+        core.endpoints.endpoints[0].limiter = limiter
+    wall = percentile(durations, 50)
+    ideal = mock.latency + mock.tokens / mock.token_rate  # One answer on its own
+    return {
+        "fanout_wall_ms": wall * 1000,
+        "fanout_tokens_per_s": models * mock.tokens / wall,
+        "fanout_efficiency": ideal / wall,
+    }
+
+def bench_adaptive(core, app, mock, rounds, models=2, generations=24):
+    """Two models streaming back to back, on a host that shares its token rate and on one that doesn't.
+
+    On the shared host running both at once gains nothing and the limiter
+    serializes them, which must not cost throughput while it measures; on the
+    other it must keep them parallel.
+    """
+    mock.latency, mock.token_rate, mock.tokens = 0.0, 400.0, 50
+    endpoint = core.endpoints.endpoints[0]
+    original = endpoint.limiter
+    results = {}
+    try:
+        for name, shared in (("shared", True), ("parallel", False)):
+            mock.shared_rate = shared
+            endpoint.limiter = core.AdaptiveLimiter(original.name)
+
+            def worker(i):
+                for n in range(generations // models):
+                    core.stream_generate(mock.loaded[i % len(mock.loaded)], f"Benchmark prompt {name} {i} {n}")
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(models)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f"adaptive_{name}_tokens_per_s"] = generations * mock.tokens / (time.perf_counter() - start)
+    finally:
+        mock.shared_rate = False
+        endpoint.limiter = original
+    return results
+
+def bench_startup(core, app, mock, rounds):
+    """Cold start of a fresh interpreter: importing the engine, importing the GUI, building the window."""
+    env = dict(os.environ, LMSTUDIO_BASE_URL=mock.url)
+
+    def launch(script):
+        subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    results = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        try:
+            durations = timed(lambda: launch(script), max(rounds // 4, 3), warmup=1)  # Warmup writes the bytecode cache
+        except subprocess.CalledProcessError as e:
+            if name != "startup_window_ms":
+                raise
+            print(f"Skipping window startup, Tk is unavailable: {e.stderr.decode(errors='replace').strip().splitlines()[-1]}", file=sys.stderr)
+            continue
+        results[name] = percentile(durations, 50) * 1000
+    return results
+
+BENCHMARKS = (bench_generate_text, bench_stream, bench_recovery, bench_markdown, bench_fanout, bench_adaptive, bench_startup)
+
+def compare(results, baseline, threshold):
+    """Print results next to the baseline and return the names of regressed metrics."""
+    regressions = []
+    print(f"\n{'metric':32} {'value':>12} {'baseline':>12} {'change':>9}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:32} {value:12.3f} {'-':>12} {'':>9}")
+            continue
+        change = (value - base) / base if base else 0.0
+        worse = change > threshold if METRIC_DIRECTIONS[name] == "lower" else change < -threshold
+        if worse:
+            regressions.append(name)
+        print(f"{name:32} {value:12.3f} {base:12.3f} {change:+8.1%}{'  REGRESSED' if worse else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LM Studio client against a local mock server.")
+    parser.add_argument("--rounds", type=int, default=40, help="Measured calls per benchmark")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed fractional regression")
+    parser.add_argument("--load-latency", type=float, default=0.05, help="Seconds the mock takes to load a model")
+    parser.add_argument("--only", help="Comma-separated benchmark names to run, e.g. stream,fanout")
+    args = parser.parse_args(argv)
+
+    mock = MockLMStudio(load_latency=args.load_latency).start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            core, app = load_app(mock.url)
+        selected = [b for b in BENCHMARKS if not args.only or b.__name__[len("bench_"):] in args.only.split(",")]
+        results = {}
+        for bench in selected:
+            print(f"Running {bench.__name__[len('bench_'):]}...")
+            log = io.StringIO()  # The app prints every load and unload; only show it on failure
+            try:
+                with contextlib.redirect_stdout(log):
+                    results.update(bench(core, app, mock, args.rounds))
+            except Exception:
+                print(log.getvalue(), end="")
+                raise
+        core.lm_client.close()
+    finally:
+        mock.stop()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("metrics", {})
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "recorded": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "metrics": results,
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    if not baseline:
+        print("\nNo baseline yet; run with --save-baseline to record one.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
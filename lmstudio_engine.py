@@ -0,0 +1,2445 @@
+"""LM Studio client and generation engine, without the GUI.
+
+Everything "ai apis.py" needs to talk to LM Studio lives here: the pooled
+HTTP client, model loading, the response cache, the results store,
+streaming, conversations, the GenerationEngine and batch mode. Importing
+it is cheap; requests and asyncio are only imported by the functions that
+use them, so scripts can import this module without paying for the
+network stack until they make a request.
+
+    python lmstudio_engine.py --batch prompts.jsonl --models openai/gpt-oss-20b
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import queue
+from collections import deque, OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+import time
+import os
+import sys
+import hashlib
+import sqlite3
+import zlib
+import socket
+import heapq
+import itertools
+
+CONFIG_PATH = os.environ.get("LMSTUDIO_CONFIG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "lmstudio_config.json")
+
+# Used for whatever the config file leaves out
+DEFAULT_CONFIG = {
+    # Base URL for your LM Studio instance (replace with actual address); a list balances
+    # generations across several hosts, the first one being the default
+    "base_url": "http://localhost:1234",  # Example - check LM Studio's documentation
+    "api_key": "sk-lm-J6JKbAiq:eq3B92fGGwdIneldysVH",
+    "models": [
+        "google/gemma-3-12b",
+        "deepseek/deepseek-r1-0528-qwen3-8b",
+        "openai/gpt-oss-20b"
+    ],
+    # Fields added to every chat request and to every model load
+    "defaults": {
+        "chat": {"temperature": 0.7},  # Adjust for creativity vs. determinism; max_output_tokens, top_p, ... also go here
+        "load": {"flash_attention": True},  # context_length, ... also go here
+    },
+    "profiles": {},  # Model name -> {"chat": {...}, "load": {...}} overriding "defaults" for that model
+}
+
+def load_config(path=CONFIG_PATH):
+    """Read the JSON config file at `path` over DEFAULT_CONFIG.
+
+    A missing file gives the defaults. "defaults" is merged field by field,
+    so a file that only sets max_output_tokens keeps the default temperature
+    and load options.
+
+    Raises:
+        ValueError: If the file isn't a JSON object.
+    """
+    loaded = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            try:
+                loaded = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"Config file {path} is not valid JSON: {e}")
+        if not isinstance(loaded, dict):
+            raise ValueError(f"Config file {path} must hold a JSON object")
+    config = dict(DEFAULT_CONFIG, **loaded)
+    loaded_defaults = loaded.get("defaults") or {}
+    config["defaults"] = {k: dict(DEFAULT_CONFIG["defaults"][k], **(loaded_defaults.get(k) or {})) for k in ("chat", "load")}
+    return config
+
+config = load_config()
+
+# LMSTUDIO_BASE_URL overrides the config file; either may be a comma-separated list
+_base_urls = os.environ.get("LMSTUDIO_BASE_URL") or config["base_url"]
+if isinstance(_base_urls, str):
+    _base_urls = _base_urls.split(",")
+BASE_URLS = [url.strip() for url in _base_urls if url.strip()]
+BASE_URL = BASE_URLS[0]
+
+API_KEY = config["api_key"]
+
+available_models = list(config["models"])
+
+class ModelProfile:
+    """Chat and load settings for one model, with its request parts prebuilt.
+
+    `chat` holds the fields sent with every chat request (sampling
+    parameters, max_output_tokens, ...) and `load` those sent when the model
+    is loaded (context_length, flash_attention, ...). The static part of the
+    chat body is serialized once; body() only encodes the prompt.
+    """
+
+    HEADERS = {"Content-Type": "application/json"}
+    STREAM_HEADERS = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    PER_REQUEST_FIELDS = ("input", "stream", "previous_response_id")  # Set by body(), never by a profile
+
+    def __init__(self, model_name, chat=None, load=None):
+        self.model_name = model_name
+        self.chat = {k: v for k, v in (chat or {}).items() if k not in self.PER_REQUEST_FIELDS}
+        self.load = dict(load or {})
+        static = dict(self.chat, model=model_name)
+        self._prefix = json.dumps(static)[:-1]  # Without the closing brace
+        self.signature = json.dumps(static, sort_keys=True, ensure_ascii=False)  # Identifies the settings in cache keys
+        self.load_body = dict(self.load, model=model_name)
+
+    def body(self, prompt, stream=False, previous_response_id=None):
+        """The JSON chat request body for `prompt`."""
+        parts = [self._prefix, ', "input": ', json.dumps(prompt)]
+        if previous_response_id:
+            parts += [', "previous_response_id": ', json.dumps(previous_response_id)]
+        if stream:
+            parts.append(', "stream": true')
+        parts.append("}")
+        return "".join(parts)
+
+    def cacheable(self, cache_mode=None):
+        """Whether this profile's answers may be served from or stored in the response cache."""
+        cache_mode = cache_mode or CACHE_MODE
+        if cache_mode == "off":
+            return False
+        if cache_mode == "deterministic":
+            return self.chat.get("temperature") == 0
+        return True
+
+_profiles = {}  # model name -> ModelProfile, built on first use
+
+def profile_for(model_name):
+    """The ModelProfile for `model_name`: the config's "defaults" overridden by its entry in "profiles"."""
+    profile = _profiles.get(model_name)
+    if profile is None:
+        defaults = config["defaults"]
+        own = config["profiles"].get(model_name, {})
+        profile = _profiles[model_name] = ModelProfile(
+            model_name,
+            dict(defaults.get("chat") or {}, **own.get("chat", {})),
+            dict(defaults.get("load") or {}, **own.get("load", {})),
+        )
+    return profile
+
+METRICS_WINDOW = 1000  # Most recent samples kept per model and metric for percentiles
+# Client-side measurements, in request lifecycle order: (name, unit, description)
+METRIC_DEFINITIONS = (
+    ("queue_wait", "seconds", "Time a generation waited for an engine slot"),
+    ("host_wait", "seconds", "Time a generation waited for its host's adaptive concurrency limit"),
+    ("connect", "seconds", "Time from sending the request until response headers arrived"),
+    ("ttft", "seconds", "Time to the first streamed token"),
+    ("tokens_per_second", "", "Output tokens per second after the first token"),
+    ("total_latency", "seconds", "Time from sending the request to the last token"),
+    ("recovery", "seconds", "Time spent loading/reloading a model after a failed request"),
+    ("render", "seconds", "Tk time spent rendering a model's output"),
+    ("prompt_tokens", "tokens", "Estimated prompt tokens sent for a conversation turn"),
+    ("prompt_tokens_saved", "tokens", "Estimated history tokens a conversation turn did not resend"),
+)
+METRIC_NAMES = tuple(name for name, _, _ in METRIC_DEFINITIONS)
+METRIC_PERCENTILES = (50, 95, 99)
+
+class MetricsRecorder:
+    """Per-model latency and throughput samples with percentile summaries.
+
+    Each (model, metric) pair keeps its last METRICS_WINDOW samples for
+    p50/p95/p99 plus a running count and sum over the whole session.
+    Thread-safe; observe() is cheap enough to call from the hot path.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}  # (model, metric) -> deque of recent values
+        self._totals = {}  # (model, metric) -> [count, sum]
+
+    def observe(self, model_name, metric, value):
+        if value is None:
+            return
+        key = (model_name, metric)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+                self._totals[key] = [0, 0.0]
+            samples.append(value)
+            totals = self._totals[key]
+            totals[0] += 1
+            totals[1] += value
+
+    @staticmethod
+    def _percentile(sorted_values, pct):
+        # Nearest-rank percentile
+        index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+        return sorted_values[index]
+
+    def summary(self):
+        """Return {model: {metric: {"count", "sum", "mean", "p50", "p95", "p99"}}}."""
+        with self._lock:
+            snapshot = {key: (sorted(samples), list(self._totals[key])) for key, samples in self._samples.items()}
+        result = {}
+        for (model_name, metric), (values, (count, total)) in snapshot.items():
+            entry = {"count": count, "sum": total, "mean": total / count if count else 0.0}
+            for pct in METRIC_PERCENTILES:
+                entry[f"p{pct}"] = self._percentile(values, pct) if values else None
+            result.setdefault(model_name, {})[metric] = entry
+        return result
+
+    def export_prometheus(self, path):
+        """Write all metrics as Prometheus text-format summaries."""
+        summary = self.summary()
+        lines = []
+        for name, unit, description in METRIC_DEFINITIONS:
+            prom_name = f"dual_llm_{name}" + (f"_{unit}" if unit else "")
+            rows = [(model_name, metrics[name]) for model_name, metrics in sorted(summary.items()) if name in metrics]
+            if not rows:
+                continue
+            lines.append(f"# HELP {prom_name} {description}")
+            lines.append(f"# TYPE {prom_name} summary")
+            for model_name, entry in rows:
+                label = model_name.replace("\\", "\\\\").replace('"', '\\"')
+                for pct in METRIC_PERCENTILES:
+                    lines.append(f'{prom_name}{{model="{label}",quantile="{pct / 100:g}"}} {entry[f"p{pct}"]:.6g}')
+                lines.append(f'{prom_name}_sum{{model="{label}"}} {entry["sum"]:.6g}')
+                lines.append(f'{prom_name}_count{{model="{label}"}} {entry["count"]}')
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def export_csv(self, path):
+        """Write one CSV row per model and metric."""
+        import csv
+        summary = self.summary()
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["model", "metric", "count", "mean"] + [f"p{pct}" for pct in METRIC_PERCENTILES])
+            for model_name, metrics_by_name in sorted(summary.items()):
+                for name in METRIC_NAMES:
+                    entry = metrics_by_name.get(name)
+                    if entry:
+                        writer.writerow([model_name, name, entry["count"], entry["mean"]] + [entry[f"p{pct}"] for pct in METRIC_PERCENTILES])
+
+    def export(self, path):
+        """Export to `path`, as CSV if it ends in .csv and Prometheus text otherwise."""
+        if path.lower().endswith(".csv"):
+            self.export_csv(path)
+        else:
+            self.export_prometheus(path)
+
+metrics = MetricsRecorder()
+
+# Per-endpoint (connect, read) timeouts in seconds
+DEFAULT_TIMEOUTS = {
+    "models": (3.05, 10),
+    "load": (3.05, 300),  # Loading a large model from disk can take minutes
+    "unload": (3.05, 30),
+    "chat": (3.05, 600),  # Read timeout between bytes; reasoning models can think for a long time
+}
+
+class LMStudioClient:
+    """Pooled keep-alive HTTP client shared by every LM Studio call.
+
+    Wraps a single requests.Session so TCP connections are reused across
+    calls and threads. Failed connects and 502/503/504 answers are retried
+    with exponential backoff; other failures are left to the caller. The
+    session is only built on the first request, so creating a client
+    doesn't import requests.
+    """
+
+    def __init__(self, base_url=BASE_URL, api_key=API_KEY, pool_size=8, retries=3, backoff=0.5, timeouts=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._adapter = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The requests.Session, created (and requests imported) on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Only GET is retried on bad status; POSTs (chat, load, unload) are only
+        # retried when the connection itself failed, so nothing runs twice.
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.headers.update({"Authorization": f"Bearer {self.api_key}"})
+        session.mount("http://", self._adapter)
+        session.mount("https://", self._adapter)
+        return session
+
+    def get(self, endpoint, path, **kwargs):
+        """GET `path` using the timeout configured for `endpoint`."""
+        kwargs.setdefault("timeout", self.timeouts[endpoint])
+        return self.session.get(f"{self.base_url}{path}", **kwargs)
+
+    def post(self, endpoint, path, **kwargs):
+        """POST to `path` using the timeout configured for `endpoint`."""
+        kwargs.setdefault("timeout", self.timeouts[endpoint])
+        return self.session.post(f"{self.base_url}{path}", **kwargs)
+
+    def connection_stats(self):
+        """Return counts of requests sent, new connections opened and connections reused."""
+        requests_sent = 0
+        new_connections = 0
+        pools = self._adapter.poolmanager.pools if self._adapter else {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            new_connections += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": max(requests_sent - new_connections, 0),
+        }
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+# Shared client used whenever an API function isn't given one explicitly
+lm_client = LMStudioClient()
+
+def get_loaded_models(client=None):
+    """Get list of currently loaded models."""
+    import requests
+    client = client or lm_client
+    
+    try:
+        response = client.get("models", "/api/v1/models")
+        response.raise_for_status()
+        data = response.json()
+        return data.get("data", [])
+    except requests.exceptions.RequestException as e:
+        print(f"Error getting loaded models: {e}")
+        return []
+
+MODEL_REGISTRY_TTL = 2.0  # Seconds a cached /api/v1/models answer is considered fresh
+
+class ModelRegistry:
+    """Cached, thread-safe view of the models loaded in LM Studio.
+
+    The loaded-model list is fetched at most once per `ttl` seconds. Callers
+    that ask while a fetch is already running wait for that fetch and share
+    its result instead of sending their own request. Anything that loads or
+    unloads a model must call invalidate() so the next read goes to the server.
+
+    The registry also tracks which model instance each side is using,
+    guarded by the same lock so both worker threads can update it.
+    """
+
+    def __init__(self, client=None, ttl=MODEL_REGISTRY_TTL):
+        self.client = client or lm_client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fetch_done = threading.Condition(self._lock)
+        self._models = []
+        self._fetched_at = None
+        self._fetching = False
+        self._fetch_count = 0  # Completed fetches, lets waiters detect a new result
+        self._generation = 0  # Bumped by invalidate() so in-flight fetches don't cache stale data
+        self._model_instances = {}
+
+    def models(self, max_age=None):
+        """Return the loaded-model list, fetching it if the cache is older than `max_age`."""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            while True:
+                if self._fetched_at is not None and time.monotonic() - self._fetched_at <= max_age:
+                    return list(self._models)
+                if not self._fetching:
+                    break
+                # Someone else is fetching; share their answer
+                seen = self._fetch_count
+                while self._fetching and self._fetch_count == seen:
+                    self._fetch_done.wait()
+                if self._fetch_count != seen and self._fetched_at is not None:
+                    return list(self._models)
+            self._fetching = True
+            generation = self._generation
+
+        models = []
+        try:
+            models = get_loaded_models(self.client)
+        finally:
+            with self._lock:
+                self._fetching = False
+                self._fetch_count += 1
+                if generation == self._generation:
+                    self._models = models
+                    self._fetched_at = time.monotonic()
+                self._fetch_done.notify_all()
+        return list(models)
+
+    def model_ids(self, max_age=None):
+        """Return the ids of all loaded models (including "name:N" duplicate instances)."""
+        ids = []
+        for m in self.models(max_age):
+            model_id = m.get("id") or m.get("model")
+            if model_id:
+                ids.append(model_id)
+        return ids
+
+    def duplicate_instances(self, model_name, max_age=None):
+        """Return the "{model_name}:N" instance ids currently loaded."""
+        return [model_id for model_id in self.model_ids(max_age) if model_id.startswith(model_name + ":")]
+
+    def store(self, models):
+        """Cache a loaded-model list fetched elsewhere, e.g. by a health check."""
+        with self._lock:
+            self._models = list(models)
+            self._fetched_at = time.monotonic()
+            self._fetch_count += 1
+            self._fetch_done.notify_all()
+
+    def invalidate(self):
+        """Drop the cached list; call after loading or unloading a model."""
+        with self._lock:
+            self._fetched_at = None
+            self._generation += 1
+
+    def set_side(self, side, model_name, instance_id=None):
+        """Record the instance id a side is using; it defaults to the model name."""
+        with self._lock:
+            self._model_instances[side] = instance_id or model_name
+
+    def clear_side(self, side):
+        """Forget the instance id of a side."""
+        with self._lock:
+            self._model_instances.pop(side, None)
+
+    def instance_for(self, side):
+        with self._lock:
+            return self._model_instances.get(side)
+
+# Shared registry for the default client
+model_registry = ModelRegistry()
+
+def load_model(model_name, client=None, registry=None):
+    """Load a model in LM Studio."""
+    import requests
+    client = client or lm_client
+    registry = registry or model_registry
+    
+    # Check for and unload any duplicate instances first
+    current_models = registry.models()
+    for model in current_models:
+        model_id = model.get("id") or model.get("model")
+        if model_id and model_id.startswith(model_name + ":"):
+            # Found a duplicate, unload it
+            print(f"Unloading duplicate instance: {model_id}")
+            unload_model(model_name, specific_instance=model_id, client=client, registry=registry)
+    
+    try:
+        response = client.post("load", "/api/v1/models/load", json=profile_for(model_name).load_body)
+        response.raise_for_status()
+        result = response.json()
+        print(f"Model {model_name} loaded successfully")
+        return result
+    except requests.exceptions.RequestException as e:
+        print(f"Error loading model {model_name}: {e}")
+        return None
+    finally:
+        registry.invalidate()
+
+def unload_model(model_name, specific_instance=None, client=None, registry=None):
+    """Unload a model in LM Studio.
+    
+    Args:
+        model_name (str): The name of the model to unload.
+        specific_instance (str, optional): The specific instance ID (e.g., 'model:2') to unload.
+                                          If None, unloads the base model.
+        client (LMStudioClient, optional): Client to send the request with. Defaults to `lm_client`.
+        registry (ModelRegistry, optional): Registry to invalidate afterwards. Defaults to `model_registry`.
+    """
+    import requests
+    client = client or lm_client
+    registry = registry or model_registry
+    
+    # Use specific instance if provided, otherwise use base model name
+    unload_target = specific_instance if specific_instance else model_name
+    
+    data = {
+        "model": unload_target
+    }
+    
+    try:
+        response = client.post("unload", "/api/v1/models/unload", json=data)
+        response.raise_for_status()
+        print(f"Model {unload_target} unloaded successfully")
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"Error unloading model {unload_target}: {e}")
+        return False
+    finally:
+        registry.invalidate()
+
+def remove_duplicate_instances(model_name, keep=1, client=None, registry=None):
+    """Unload duplicate loaded instances of a model, keeping only `keep` instances.
+
+    This scans currently loaded models for instance ids that start with
+    "{model_name}:" and unloads extras.
+    """
+    registry = registry or model_registry
+    instances = registry.duplicate_instances(model_name)
+
+    # If there are more instances than desired, unload the extras
+    if len(instances) > keep:
+        # Keep the first `keep` instances and unload the rest
+        to_unload = instances[keep:]
+        for inst in to_unload:
+            print(f"Found duplicate instance for {model_name}: {inst} - unloading")
+            unload_model(model_name, specific_instance=inst, client=client, registry=registry)
+
+def ensure_model_loaded(model_name, side=None, client=None, registry=None):
+    """Ensure the specified model is loaded.
+
+    Returns:
+        bool: True if the model had to be loaded, False if it already was.
+    """
+    registry = registry or model_registry
+    current_model_ids = registry.model_ids()
+    
+    # Check if the model is already loaded
+    if model_name in current_model_ids:
+        # Model is already loaded, just update our tracking
+        if side:
+            registry.set_side(side, model_name)
+        return False
+
+    # Model not loaded at all, load it
+    load_result = load_model(model_name, client, registry)
+    if side:
+        # Extract model instance ID from response
+        instance_id = (load_result.get("id") or load_result.get("model_id")) if load_result else None
+        registry.set_side(side, model_name, instance_id)
+    return True
+
+WARM_POOL_MAX_MODELS = 2  # Models kept loaded at once; the least recently used is unloaded first, never one selected in a pane
+WARM_POOL_MAX_BYTES = None  # Optional VRAM budget, using the size_bytes LM Studio reports per model
+WARM_POOL_PRELOAD_ON_START = True  # Load the models selected in the panes when the window opens
+
+class WarmPool:
+    """Keeps the models being compared loaded ahead of the first prompt.
+
+    ensure() loads a model if it isn't loaded yet; EndpointPool.preload()
+    calls it in the background as soon as a model is picked, so the first
+    prompt doesn't pay for a failed request plus the load, and the recovery
+    path calls it directly. Loads of the same model are serialized, so a
+    preload and a recovery never load it twice, and duplicate instances are
+    removed once right after a load.
+
+    Every model the pool loads or sees used is tracked least recently used
+    first. When more than `max_models` (or more than `max_bytes` of
+    reported model size) are tracked, the oldest ones not currently
+    generating are unloaded. Models in `pinned` (those selected in the
+    panes) are never unloaded, so with more panes than `max_models` only
+    deselected models are evicted.
+    """
+
+    def __init__(self, client=None, registry=None, max_models=WARM_POOL_MAX_MODELS, max_bytes=WARM_POOL_MAX_BYTES):
+        self.client = client or lm_client
+        self.registry = registry or model_registry
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()  # model_name -> reported size in bytes (or None), oldest first
+        self._in_use = {}  # model_name -> generations currently running
+        self.pinned = frozenset()  # Models selected in the panes
+        self._load_locks = {}
+
+    def _model_lock(self, model_name):
+        with self._lock:
+            return self._load_locks.setdefault(model_name, threading.Lock())
+
+    def _model_size(self, model_name):
+        for m in self.registry.models():
+            if (m.get("id") or m.get("model")) == model_name:
+                return m.get("size_bytes")
+        return None
+
+    def ensure(self, model_name, side=None):
+        """Make sure `model_name` is loaded, loading it if needed, then enforce the budget."""
+        with self._model_lock(model_name):
+            loaded_now = ensure_model_loaded(model_name, side, self.client, self.registry)
+            if loaded_now:
+                # One clean-up right after the load replaces polling for duplicates
+                remove_duplicate_instances(model_name, keep=1, client=self.client, registry=self.registry)
+        self.touch(model_name)
+        self.evict_over_budget(protect=model_name)
+
+    def touch(self, model_name):
+        """Mark `model_name` as just used."""
+        with self._lock:
+            known = model_name in self._lru
+            size = self._lru.pop(model_name, None)
+            self._lru[model_name] = size
+        if not known and self.max_bytes:
+            # Only a byte budget needs the size; look it up once per model
+            size = self._model_size(model_name)
+            with self._lock:
+                if model_name in self._lru:
+                    self._lru[model_name] = size
+
+    @contextmanager
+    def using(self, model_name):
+        """Protect `model_name` from eviction while a generation runs on it."""
+        with self._lock:
+            self._in_use[model_name] = self._in_use.get(model_name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use[model_name] -= 1
+                if not self._in_use[model_name]:
+                    del self._in_use[model_name]
+            self.touch(model_name)
+
+    def pin(self, model_names):
+        """Keep exactly `model_names` safe from eviction, replacing the previous set."""
+        with self._lock:
+            self.pinned = frozenset(model_names)
+
+    def _over_budget(self):
+        if len(self._lru) > self.max_models:
+            return True
+        if self.max_bytes:
+            return sum(size or 0 for size in self._lru.values()) > self.max_bytes
+        return False
+
+    def evict_over_budget(self, protect=None):
+        """Unload least recently used models until the pool fits its budget."""
+        while True:
+            with self._lock:
+                if not self._over_budget():
+                    return
+                victim = next((m for m in self._lru if m != protect and m not in self._in_use and m not in self.pinned), None)
+                if victim is None:
+                    return  # Everything left is busy; try again after the next use
+                del self._lru[victim]
+            print(f"Warm pool over budget, unloading least recently used model {victim}")
+            unload_model(victim, client=self.client, registry=self.registry)
+
+    def loaded(self):
+        """Models tracked by the pool, least recently used first."""
+        with self._lock:
+            return list(self._lru)
+
+warm_pool = WarmPool()
+
+ENDPOINT_HEALTH_INTERVAL = 10.0  # Seconds between health checks of each host when there are several
+ENDPOINT_FAILURE_THRESHOLD = 3  # Consecutive host failures that open a host's circuit breaker
+ENDPOINT_COOLDOWN = 30.0  # Seconds an open breaker keeps a host out of rotation before it is tried again
+ENDPOINT_MODELS_MAX_AGE = 2 * ENDPOINT_HEALTH_INTERVAL  # Loaded-model lists older than this are refetched when routing
+ENDPOINT_RESPONSE_MEMORY = 1000  # Stored response ids remembered so conversations stay on their host
+
+def _is_host_failure(error):
+    """Whether `error` says something about the host rather than the request."""
+    import requests
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.exceptions.HTTPError) and response is not None and response.status_code >= 500
+
+ADAPTIVE_INITIAL_LIMIT = 2  # Generations a host starts with at once; the two panes used to always run in parallel
+ADAPTIVE_MAX_LIMIT = 4  # Most generations the limiter will ever allow on one host at once
+ADAPTIVE_WINDOW = 4  # Completed generations per throughput measurement (at least the current limit)
+ADAPTIVE_GAIN = 0.1  # Running one more generation at once must raise throughput by this fraction to be worth it
+ADAPTIVE_PROBE_WINDOWS = 10  # Measurements before a higher limit that lost is tried again
+ADAPTIVE_SMOOTHING = 0.5  # Weight of the newest measurement in each concurrency level's throughput
+
+class AdaptiveLimiter:
+    """AIMD limit on the generations one host runs at once.
+
+    Completed generations are measured in windows of ADAPTIVE_WINDOW. Each
+    window gives the average number of generations the host was running
+    while busy (its level) and its aggregate throughput: output tokens per
+    second each generation held its slot, times the level. Generations still
+    running when a window closes don't skew it. The throughput is averaged
+    per level. If a level doesn't beat the level
+    below it by ADAPTIVE_GAIN, the limit is halved (multiplicative
+    decrease), so two models thrashing one GPU end up serialized. If the
+    host ran at its limit and did gain, the limit grows by one (additive
+    increase): at once if the next level hasn't been measured or did
+    better, otherwise after ADAPTIVE_PROBE_WINDOWS windows. A level whose
+    lower neighbour was never measured steps down once to measure it.
+
+    Every change is printed and kept in `decisions`. With `adaptive` False
+    the limit stays where it is set.
+    """
+
+    def __init__(self, name, limit=ADAPTIVE_INITIAL_LIMIT, max_limit=ADAPTIVE_MAX_LIMIT, adaptive=True):
+        self.name = name
+        self.limit = limit
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.active = 0
+        self.throughput = {}  # level -> smoothed aggregate tokens per busy second
+        self.decisions = deque(maxlen=100)  # (time, old limit, new limit, reason)
+        self._condition = threading.Condition()
+        self._windows = 0  # Windows measured since the limit last changed
+        self._changed_at = time.monotonic()
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_count = 0
+        self._window_tokens = 0
+        self._window_seconds = 0.0  # Slot time of the generations counted in the window
+        self._window_wait = 0.0
+        self._busy = 0.0  # Seconds with at least one generation running
+        self._area = 0.0  # Integral of running generations over time
+
+    def _advance(self, now):
+        elapsed = now - self._changed_at
+        if self.active:
+            self._busy += elapsed
+            self._area += self.active * elapsed
+        self._changed_at = now
+
+    def acquire(self, cancel_event=None):
+        """Wait for a free slot and take it; returns the seconds waited.
+
+        Raises GenerationCancelled if `cancel_event` is set while waiting.
+        """
+        start = time.monotonic()
+        with self._condition:
+            while self.active >= self.limit:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled(f"Cancelled while queued for {self.name}")
+                self._condition.wait(0.1)
+            now = time.monotonic()
+            self._advance(now)
+            self.active += 1
+            self._window_wait += now - start
+        return now - start
+
+    def release(self, tokens=None, seconds=None):
+        """Free a slot held for `seconds`; `tokens` is the output of a generation that ran, None if it failed or was cached."""
+        decision = None
+        with self._condition:
+            self._advance(time.monotonic())
+            self.active -= 1
+            self._condition.notify()
+            if tokens is not None and seconds and self.adaptive:
+                self._window_count += 1
+                self._window_tokens += tokens
+                self._window_seconds += seconds
+                if self._window_count >= max(ADAPTIVE_WINDOW, self.limit):
+                    decision = self._decide()
+                    self._condition.notify_all()  # A higher limit may free several waiters
+        if decision:
+            print(f"Concurrency for {self.name}: {decision[1]} -> {decision[2]} ({decision[3]})")
+
+    def _decide(self):
+        if self._busy <= 0:
+            self._reset_window()
+            return None
+        running = self._area / self._busy
+        measured = self._window_tokens / self._window_seconds * running
+        level = max(1, min(self.limit, round(running)))
+        wait = self._window_wait / self._window_count
+        self._reset_window()
+
+        previous = self.throughput.get(level)
+        current = self.throughput[level] = measured if previous is None else previous + ADAPTIVE_SMOOTHING * (measured - previous)
+        self._windows += 1
+        lower = self.throughput.get(level - 1)
+        higher = self.throughput.get(level + 1)
+        summary = f"{current:.0f} tok/s running {level} at once, queue wait {wait:.2f} s"
+        if level > 1 and lower is None:
+            new, reason = level - 1, f"measuring {level - 1} for comparison; {summary}"
+        elif level > 1 and current < lower * (1 + ADAPTIVE_GAIN):
+            new, reason = max(level // 2, 1), f"{summary} vs {lower:.0f} running {level - 1}"
+        elif level == self.limit < self.max_limit and (higher is None or higher > current * (1 + ADAPTIVE_GAIN) or self._windows >= ADAPTIVE_PROBE_WINDOWS):
+            new, reason = level + 1, f"probing; {summary}"
+        else:
+            return None
+        if new == self.limit:
+            return None
+        if new == 1:
+            reason += "; serializing"
+        decision = (time.time(), self.limit, new, reason)
+        self.limit = new
+        self._windows = 0
+        self.decisions.append(decision)
+        return decision
+
+class Endpoint:
+    """One LM Studio host with its own client, model registry, warm pool and concurrency limiter.
+
+    Breaker state (`failures`, `opened_at`) and `in_flight` are guarded by
+    the owning EndpointPool's lock.
+    """
+
+    def __init__(self, url, client=None, registry=None, pool=None):
+        self.client = client or LMStudioClient(url)
+        self.url = self.client.base_url
+        self.registry = registry or ModelRegistry(self.client)
+        self.warm_pool = pool or WarmPool(self.client, self.registry)
+        self.limiter = AdaptiveLimiter(self.url)
+        self.in_flight = 0
+        self.failures = 0  # Consecutive host failures
+        self.opened_at = None  # When the breaker opened; None while closed
+
+    def available(self, now):
+        """Closed breaker, or open long enough that one request may test the host again."""
+        return self.opened_at is None or now - self.opened_at >= ENDPOINT_COOLDOWN
+
+    def has_model(self, model_name):
+        return model_name in self.registry.model_ids(max_age=ENDPOINT_MODELS_MAX_AGE)
+
+class EndpointPool:
+    """Routes generations across several LM Studio hosts.
+
+    pick() sends a model to the least busy healthy host that already has it
+    loaded, or to the least busy healthy host if none has. A conversation
+    goes back to the host holding its stored response. Connection errors,
+    timeouts and 5xx answers count against a host; after
+    ENDPOINT_FAILURE_THRESHOLD in a row its breaker opens and it is skipped
+    for ENDPOINT_COOLDOWN seconds, after which a single request or health
+    check decides whether it rejoins. With more than one host, a background
+    thread checks every host each ENDPOINT_HEALTH_INTERVAL seconds and keeps
+    their loaded-model lists fresh.
+    """
+
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()  # response_id -> Endpoint, oldest first
+        self._health_thread = None
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preload")
+
+    def pick(self, model_name, exclude=(), previous_response_id=None):
+        """Choose the host for a generation of `model_name`, avoiding `exclude` if possible."""
+        self._start_health_checks()
+        now = time.monotonic()
+        with self._lock:
+            owner = self._responses.get(previous_response_id) if previous_response_id else None
+            if owner is not None and owner not in exclude and owner.available(now):
+                return owner
+            candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+            if not candidates:
+                # Every host is down or excluded; trying the one down longest beats failing outright
+                fallback = [e for e in self.endpoints if e not in exclude] or self.endpoints
+                return min(fallback, key=lambda e: e.opened_at or 0.0)
+        if len(candidates) > 1:
+            warm = [e for e in candidates if e.has_model(model_name)]
+            candidates = warm or candidates
+        with self._lock:
+            return min(candidates, key=lambda e: e.in_flight)
+
+    def begin(self, endpoint):
+        """Count a request starting on `endpoint`."""
+        with self._lock:
+            endpoint.in_flight += 1
+
+    def finish(self, endpoint, error=None, stats=None):
+        """Count a request ending on `endpoint` and update its breaker.
+
+        A cancelled request says nothing about the host. A `response_id` in
+        `stats` is remembered so the conversation continues on this host.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            response_id = (stats or {}).get("response_id")
+            if response_id:
+                self._responses[response_id] = endpoint
+                if len(self._responses) > ENDPOINT_RESPONSE_MEMORY:
+                    self._responses.popitem(last=False)
+        if isinstance(error, GenerationCancelled):
+            return
+        self._record(endpoint, error is None or not _is_host_failure(error))
+
+    def _record(self, endpoint, healthy):
+        recovered = tripped = False
+        with self._lock:
+            if healthy:
+                recovered = endpoint.opened_at is not None
+                endpoint.failures, endpoint.opened_at = 0, None
+            else:
+                endpoint.failures += 1
+                tripped = endpoint.failures >= ENDPOINT_FAILURE_THRESHOLD
+                if tripped:
+                    endpoint.opened_at = time.monotonic()  # Also re-opens a half-open breaker
+        if len(self.endpoints) < 2:
+            return  # With a single host there's nothing to route around
+        if healthy and recovered:
+            print(f"LM Studio at {endpoint.url} is healthy again")
+        elif not healthy and tripped:
+            print(f"LM Studio at {endpoint.url} failed {endpoint.failures} times in a row; skipping it for {ENDPOINT_COOLDOWN:.0f} s")
+
+    def check(self, endpoint):
+        """Health-check one host, refreshing its loaded-model list on success."""
+        try:
+            response = endpoint.client.get("models", "/api/v1/models")
+            response.raise_for_status()
+            endpoint.registry.store(response.json().get("data", []))
+        except Exception:
+            self._record(endpoint, False)
+            return False
+        self._record(endpoint, True)
+        return True
+
+    def _start_health_checks(self):
+        if len(self.endpoints) < 2 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="endpoint-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(ENDPOINT_HEALTH_INTERVAL)
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                with self._lock:
+                    due = endpoint.available(now)
+                if due:
+                    self.check(endpoint)
+
+    def ensure(self, endpoint, model_name, side=None):
+        """Load `model_name` on `endpoint` if needed and make it the host `side` is tracked on."""
+        endpoint.warm_pool.ensure(model_name, side)
+        if side:
+            for other in self.endpoints:
+                if other is not endpoint:
+                    other.registry.clear_side(side)
+
+    def preload(self, model_name):
+        """Start loading `model_name` on the host it would be routed to; returns a Future.
+
+        Picking the host can fetch loaded-model lists, so it runs on the
+        preload thread as well and never blocks the caller.
+        """
+        return self.executor.submit(self._preload, model_name)
+
+    def _preload(self, model_name):
+        try:
+            self.pick(model_name).warm_pool.ensure(model_name)
+        except Exception as e:
+            print(f"Preloading {model_name} failed: {e}")
+
+    def pin(self, model_names):
+        """Keep `model_names` (the models selected in the panes) loaded on every host that has them."""
+        model_names = frozenset(model_names)
+        for endpoint in self.endpoints:
+            endpoint.warm_pool.pin(model_names)
+
+    def instance_for(self, side):
+        """The model instance id `side` was last loaded as, on whichever host."""
+        for endpoint in self.endpoints:
+            instance_id = endpoint.registry.instance_for(side)
+            if instance_id:
+                return instance_id
+        return None
+
+    def connection_stats(self):
+        """LMStudioClient.connection_stats() summed over every host."""
+        totals = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+        for endpoint in self.endpoints:
+            for name, count in endpoint.client.connection_stats().items():
+                totals[name] += count
+        return totals
+
+    def status(self):
+        """(url, healthy, in_flight, limit) for every host; a host is unhealthy while its breaker is open."""
+        with self._lock:
+            return [(e.url, e.opened_at is None, e.in_flight, e.limiter.limit) for e in self.endpoints]
+
+# Every host in BASE_URLS; the first one uses the default client, registry and warm pool
+endpoints = EndpointPool([Endpoint(BASE_URL, lm_client, model_registry, warm_pool)] + [Endpoint(url) for url in BASE_URLS[1:]])
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.sqlite3")
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # Least recently used responses are evicted past this size
+CACHE_MODE = "deterministic"  # "on", "off", or "deterministic" (only cache requests with temperature 0, so sampled answers are always fresh)
+CACHE_MODES = ("on", "off", "deterministic")
+
+class ResponseCache:
+    """On-disk cache of chat responses in SQLite, keyed by the request content.
+
+    The key is a SHA-256 of the model name, prompt and every other field of
+    the request body (temperature included), so changing any sampling
+    parameter is a different entry. Entries are evicted least recently used
+    first once the stored text exceeds `max_bytes`. Safe to share between
+    threads; the database is opened on first use.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, text TEXT, model_id TEXT, stats TEXT,"
+                " size INTEGER, created REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(profile, prompt, previous_response_id=None):
+        """Hash what a request body holds apart from transport-only fields such as "stream"."""
+        keyed = json.dumps([profile.signature, prompt, previous_response_id], ensure_ascii=False)
+        return hashlib.sha256(keyed.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return (text, model_id, stats) for `key`, or None on a miss."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT text, model_id, stats FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        text, model_id, stats = row
+        return text, model_id, json.loads(stats) if stats else None
+
+    def put(self, key, model_name, text, model_id, stats):
+        """Store a response and evict old entries if the cache grew too large."""
+        size = len(text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model_name, text, model_id, json.dumps(stats) if stats else None, size, now, now),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                victims = []
+                for victim_key, victim_size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    if self._total_bytes <= self.max_bytes:
+                        break
+                    victims.append((victim_key,))
+                    self._total_bytes -= victim_size
+                conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+            }
+
+    def clear(self):
+        """Delete every cached response."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            self._total_bytes = 0
+
+response_cache = ResponseCache()
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.sqlite3")
+RESULTS_PAGE_SIZE = 100  # History rows fetched at a time
+RESULTS_FLUSH_INTERVAL = 0.5  # Seconds the writer collects rows before committing them together
+RESULTS_PREVIEW_CHARS = 100  # Prompt characters kept uncompressed for listing
+
+class ResultsStore:
+    """Append-only history of every generation in SQLite.
+
+    Prompt, output and stats are stored zlib-compressed; the model, time,
+    timings, a prompt hash and a short prompt preview stay in plain columns
+    so history can be listed and filtered without decompressing anything.
+    Indexes cover (model, created), created and prompt_hash, and a
+    contentless FTS5 table indexes prompt and output for full-text search
+    without keeping a second copy of the text. Triggers reject UPDATE and
+    DELETE.
+
+    append() only queues the row; a writer thread commits queued rows
+    together, so recording never blocks the engine. Reads use their own
+    connection and may run on any thread.
+    """
+
+    def __init__(self, path=RESULTS_PATH):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._read_conn = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " id INTEGER PRIMARY KEY, created REAL, model TEXT, model_id TEXT, side TEXT,"
+            " prompt_hash TEXT, preview TEXT, prompt BLOB, output BLOB, stats BLOB,"
+            " ttft REAL, queue_wait REAL, elapsed REAL, error TEXT);"
+            "CREATE INDEX IF NOT EXISTS generations_model_created ON generations (model, created);"
+            "CREATE INDEX IF NOT EXISTS generations_created ON generations (created);"
+            "CREATE INDEX IF NOT EXISTS generations_prompt_hash ON generations (prompt_hash);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(prompt, output, content='');"
+            "CREATE TRIGGER IF NOT EXISTS generations_no_update BEFORE UPDATE ON generations"
+            " BEGIN SELECT RAISE(ABORT, 'results are append-only'); END;"
+            "CREATE TRIGGER IF NOT EXISTS generations_no_delete BEFORE DELETE ON generations"
+            " BEGIN SELECT RAISE(ABORT, 'results are append-only'); END;"
+        )
+        return conn
+
+    @staticmethod
+    def _pack(text):
+        return zlib.compress(text.encode("utf-8")) if text is not None else None
+
+    @staticmethod
+    def _unpack(blob):
+        return zlib.decompress(blob).decode("utf-8") if blob is not None else None
+
+    def append(self, prompt, model_name, output, model_id=None, stats=None, side=None, ttft=None, queue_wait=None, elapsed=None, error=None):
+        """Queue one finished generation for writing."""
+        self._queue.put((time.time(), model_name, model_id, side, prompt, output, stats, ttft, queue_wait, elapsed, error))
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="results-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        conn = self._open()
+        while True:
+            batch = [self._queue.get()]
+            if isinstance(batch[0], tuple):
+                time.sleep(RESULTS_FLUSH_INTERVAL)  # Let more rows arrive so they share one commit; a flush or close goes ahead at once
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, [row for row in batch if isinstance(row, tuple)])
+            except sqlite3.Error as e:
+                print(f"Error saving results: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                conn.close()
+                return
+
+    def _write(self, conn, rows):
+        with conn:
+            for created, model_name, model_id, side, prompt, output, stats, ttft, queue_wait, elapsed, error in rows:
+                cursor = conn.execute(
+                    "INSERT INTO generations (created, model, model_id, side, prompt_hash, preview, prompt, output, stats, ttft, queue_wait, elapsed, error)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (created, model_name, model_id, side, hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                     " ".join(prompt.split())[:RESULTS_PREVIEW_CHARS], self._pack(prompt), self._pack(output),
+                     self._pack(json.dumps(stats)) if stats else None, ttft, queue_wait, elapsed, error),
+                )
+                conn.execute("INSERT INTO generations_fts (rowid, prompt, output) VALUES (?, ?, ?)", (cursor.lastrowid, prompt, output or ""))
+
+    def flush(self, timeout=5.0):
+        """Wait up to `timeout` seconds until everything appended so far is written.
+
+        Returns a threading.Event that is set once it is; with `timeout` 0 the
+        caller can poll it instead of blocking.
+        """
+        written = threading.Event()
+        with self._writer_lock:
+            writer = self._writer
+        if writer is None:
+            written.set()
+            return written
+        self._queue.put(written)
+        if timeout:
+            written.wait(timeout)
+        return written
+
+    def close(self):
+        """Write everything still queued and stop the writer."""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    @contextmanager
+    def _reading(self):
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = self._open()
+            yield self._read_conn
+
+    @staticmethod
+    def fts_query(text):
+        """Turn free text into an FTS5 query matching every word, the last one as a prefix."""
+        words = text.split()
+        terms = ['"' + word.replace('"', '""') + '"' for word in words]
+        if terms:
+            terms[-1] += "*"
+        return " ".join(terms)
+
+    def page(self, search=None, model_name=None, before_id=None, limit=RESULTS_PAGE_SIZE):
+        """Newest rows first, as (id, created, model, side, preview, elapsed, error) tuples.
+
+        Pass the last id of the previous page as `before_id` to get the next one.
+        """
+        conditions = []
+        params = []
+        if before_id is not None:
+            conditions.append("g.id < ?")
+            params.append(before_id)
+        if model_name:
+            conditions.append("g.model = ?")
+            params.append(model_name)
+        sql = "SELECT g.id, g.created, g.model, g.side, g.preview, g.elapsed, g.error FROM generations g"
+        if search and search.strip():
+            sql += " JOIN generations_fts f ON f.rowid = g.id"
+            conditions.insert(0, "generations_fts MATCH ?")
+            params.insert(0, self.fts_query(search))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY g.id DESC LIMIT ?"
+        params.append(limit)
+        with self._reading() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get(self, row_id):
+        """One row with prompt, output and stats decompressed, or None."""
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT id, created, model, model_id, side, prompt, output, stats, ttft, queue_wait, elapsed, error"
+                " FROM generations WHERE id = ?", (row_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "created", "model", "model_id", "side", "prompt", "output", "stats", "ttft", "queue_wait", "elapsed", "error")
+        result = dict(zip(keys, row))
+        result["prompt"] = self._unpack(result["prompt"])
+        result["output"] = self._unpack(result["output"])
+        result["stats"] = json.loads(self._unpack(result["stats"])) if result["stats"] else None
+        return result
+
+    def models(self):
+        with self._reading() as conn:
+            return [model_name for (model_name,) in conn.execute("SELECT DISTINCT model FROM generations ORDER BY model")]
+
+    def count(self):
+        with self._reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+results_store = ResultsStore()
+
+def _parse_chat_response(response_json, model_name):
+    """Extract (message_content, model_id, stats) from a /api/v1/chat response body."""
+    message_content = None
+    model_id = response_json.get("model_id") or response_json.get("id") or model_name
+
+    try:
+        for output in response_json["output"]:
+            if output["type"] == "message":
+                message_content = output["content"]
+                break  # Stop after finding the first "message" type
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"Error parsing response: {e}. Check LM Studio's API response format.")
+
+    # Extract stats if present
+    stats = response_json.get("stats") or response_json.get("metrics") or None
+    # Lets a conversation continue from this response with previous_response_id
+    response_id = response_json.get("response_id")
+    if response_id:
+        stats = dict(stats or {}, response_id=response_id)
+
+    return message_content, model_id, stats
+
+def _output_tokens(text, stats):
+    """Output tokens of a finished generation, estimated from its text if LM Studio didn't count them."""
+    return (stats or {}).get("total_output_tokens") or estimate_tokens(text or "")
+
+def generate_text(model_name, prompt, client=None, cache_mode=None, previous_response_id=None, endpoint=None, limiter=None):
+    """
+    Generates text using a specified LLM model in LM Studio.
+
+    Args:
+        model_name (str): The name of the model to use (e.g., "Llama-2-7b-Chat").
+        prompt (str): The input prompt for the model.
+        client (LMStudioClient, optional): Client to send the request with. Defaults to the host
+            `endpoints` picks for the model.
+        cache_mode (str, optional): One of CACHE_MODES. Defaults to CACHE_MODE.
+        previous_response_id (str, optional): Continue from this stored response; `prompt` is then only the new turn.
+        endpoint (Endpoint, optional): Host to use instead of the one `endpoints` would pick.
+        limiter (AdaptiveLimiter, optional): Slot to hold while the request runs; routed requests use their host's.
+
+    Returns:
+        tuple: (generated_text, model_instance_id, stats)
+    """
+
+    if client is None:
+        endpoint = endpoint or endpoints.pick(model_name, previous_response_id=previous_response_id)
+        endpoints.begin(endpoint)
+        error = result = None
+        try:
+            result = generate_text(model_name, prompt, endpoint.client, cache_mode, previous_response_id, limiter=endpoint.limiter)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            endpoints.finish(endpoint, error, result[2] if result else None)
+
+    # Sampling parameters and max_output_tokens come from the model's profile in the config file
+    profile = profile_for(model_name)
+    cache_key = ResponseCache.make_key(profile, prompt, previous_response_id) if profile.cacheable(cache_mode) else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached:
+            return cached
+
+    if limiter is not None:
+        metrics.observe(model_name, "host_wait", limiter.acquire())
+        held = time.monotonic()
+    tokens = None
+    try:
+        start = time.perf_counter()
+        response = client.post("chat", "/api/v1/chat", headers=profile.HEADERS, data=profile.body(prompt, previous_response_id=previous_response_id))
+        metrics.observe(model_name, "connect", response.elapsed.total_seconds())
+        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+        metrics.observe(model_name, "total_latency", time.perf_counter() - start)
+
+        message_content, model_id, stats = _parse_chat_response(response.json(), model_name)
+        tokens = _output_tokens(message_content, stats)
+    finally:
+        if limiter is not None:
+            limiter.release(tokens, time.monotonic() - held)
+    if cache_key and message_content:
+        response_cache.put(cache_key, model_name, message_content, model_id, stats)
+    return message_content, model_id, stats
+
+def _iter_sse_events(response):
+    """Yield (event_name, data_dict) pairs from a server-sent events response."""
+    event_name = None
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            # Blank line terminates one event
+            if data_lines:
+                payload = "\n".join(data_lines)
+                data_lines = []
+                if payload.strip() == "[DONE]":
+                    return
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    data = {"content": payload}
+                yield event_name or data.get("type"), data
+            event_name = None
+        elif line.startswith(":"):
+            continue  # SSE comment / keep-alive
+        elif line.startswith("event:"):
+            event_name = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        try:
+            data = json.loads("\n".join(data_lines))
+        except ValueError:
+            return
+        yield event_name or data.get("type"), data
+
+def generate_text_stream(model_name, prompt, client=None, cache_mode=None, cancel_event=None, previous_response_id=None, limiter=None):
+    """
+    Streams text from a model in LM Studio as it is generated.
+
+    Yields ("reasoning", text) and ("message", text) deltas as they arrive,
+    followed by a single ("done", (generated_text, model_instance_id, stats)).
+    Servers that ignore "stream" and answer with plain JSON still work; the
+    whole message is then yielded as one delta. A response cache hit yields
+    ("cached", None) and the whole message at once without contacting the server.
+    Setting `cancel_event` (a CancelScope) aborts the response mid-read.
+    With `previous_response_id`, `prompt` is only the new turn of a conversation.
+    A `limiter` slot is held from sending the request until the stream ends;
+    cache hits don't wait for one.
+    """
+    client = client or lm_client
+
+    profile = profile_for(model_name)
+    cache_key = ResponseCache.make_key(profile, prompt, previous_response_id) if profile.cacheable(cache_mode) else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached:
+            yield "cached", None
+            yield "message", cached[0]
+            yield "done", cached
+            return
+
+    if limiter is not None:
+        metrics.observe(model_name, "host_wait", limiter.acquire(cancel_event))
+        held = time.monotonic()
+    tokens = None  # Set once the generation completed, for the limiter
+    try:
+        response = client.post("chat", "/api/v1/chat", headers=profile.STREAM_HEADERS, data=profile.body(prompt, True, previous_response_id), stream=True)
+        metrics.observe(model_name, "connect", response.elapsed.total_seconds())
+        abort = lambda: _abort_response(response)
+        if cancel_event is not None:
+            cancel_event.add_callback(abort)
+        try:
+            response.raise_for_status()
+
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                # Non-streaming answer, fall back to the blocking format
+                message_content, model_id, stats = _parse_chat_response(response.json(), model_name)
+                if cache_key and message_content:
+                    response_cache.put(cache_key, model_name, message_content, model_id, stats)
+                if message_content:
+                    yield "message", message_content
+                tokens = _output_tokens(message_content, stats)
+                yield "done", (message_content, model_id, stats)
+                return
+
+            response.encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else "utf-8"
+            message_parts = []
+            model_id = model_name
+            events = _iter_sse_events(response)
+            for event, payload in events:
+                if event == "message.delta":
+                    content = payload.get("content") or ""
+                    if content:
+                        message_parts.append(content)
+                        yield "message", content
+                elif event == "reasoning.delta":
+                    content = payload.get("content") or ""
+                    if content:
+                        yield "reasoning", content
+                elif event == "error":
+                    error = payload.get("error") or payload
+                    message = error.get("message") if isinstance(error, dict) else error
+                    raise ValueError(f"Error from LM Studio stream: {message}")
+                elif event == "chat.end":
+                    result = payload.get("result") or payload
+                    message_content, end_model_id, stats = _parse_chat_response(result, model_id)
+                    if message_content is None and message_parts:
+                        message_content = "".join(message_parts)
+                    # Read to the end of the body so the connection goes back to the pool
+                    for _ in events:
+                        pass
+                    if cache_key and message_content:
+                        response_cache.put(cache_key, model_name, message_content, end_model_id, stats)
+                    tokens = _output_tokens(message_content, stats)
+                    yield "done", (message_content, end_model_id, stats)
+                    return
+
+            # Stream closed without chat.end; use what we received
+            yield "done", ("".join(message_parts) or None, model_id, None)
+        finally:
+            if cancel_event is not None:
+                cancel_event.remove_callback(abort)
+            response.close()
+    finally:
+        if limiter is not None:
+            limiter.release(tokens, time.monotonic() - held)
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is cancelled before it finished."""
+
+class CancelScope:
+    """A threading.Event-like cancel flag that also runs callbacks when set.
+
+    Callbacks interrupt work a flag can't reach, such as an HTTP read that is
+    blocked waiting for the next token. A callback added after the scope was
+    set runs immediately.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+    def add_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+def _abort_response(response):
+    """Close a streaming response from another thread, waking a reader blocked on it."""
+    # close() alone only takes effect once the next chunk arrives; shutting the
+    # socket down fails the pending read right away
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+class _SharedStream:
+    """One in-flight generation that identical (model, prompt) requests share.
+
+    The request runs on its own thread and every subscriber follows the
+    recorded deltas, so one that joins late is replayed what it missed. The
+    HTTP request is aborted as soon as the last subscriber leaves.
+    """
+
+    def __init__(self, key, client, cache_mode, endpoint=None):
+        self.key = key  # (model_name, prompt, previous_response_id)
+        self.client = client
+        self.endpoint = endpoint
+        self.cache_mode = cache_mode
+        self.subscribers = set()  # One token per stream_generate call; guarded by _inflight_lock
+        self.events = []  # (kind, payload) in arrival order
+        self.result = None
+        self.error = None
+        self.done = False
+        self.cancel_scope = CancelScope()
+        self.condition = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self._run, name="stream", daemon=True).start()
+
+    def _publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def _run(self):
+        model_name, prompt, previous_response_id = self.key
+        start = time.perf_counter()
+        ttft = None
+        deltas = 0
+        cached = False
+        result = (None, model_name, None)
+        error = None
+        client, endpoint, limiter = self.client, self.endpoint, None
+        if client is None:
+            endpoint = endpoint or endpoints.pick(model_name, previous_response_id=previous_response_id)
+            client, limiter = endpoint.client, endpoint.limiter
+            endpoints.begin(endpoint)
+        stream = generate_text_stream(model_name, prompt, client, self.cache_mode, self.cancel_scope, previous_response_id, limiter)
+        try:
+            for kind, payload in stream:
+                if kind == "done":
+                    result = payload
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if kind == "cached":
+                    cached = True
+                else:
+                    deltas += 1
+                self._publish((kind, payload))
+        except Exception as e:
+            error = GenerationCancelled(f"Generation for {model_name} was cancelled") if self.cancel_scope.is_set() else e
+        finally:
+            stream.close()
+            if endpoint is not None:
+                endpoints.finish(endpoint, error, result[2])
+            _forget_stream(self)
+            with self.condition:
+                self.result, self.error, self.done = result, error, True
+                self.condition.notify_all()
+        if error is None and not cached and result[0] is not None:
+            _record_generation_metrics(model_name, start, ttft, time.perf_counter(), deltas, result[2])
+
+    def follow(self, on_delta, cancel_event):
+        """Report deltas to `on_delta` until the stream ends or `cancel_event` is set."""
+        start = time.perf_counter()
+        ttft = None
+        index = 0
+        while True:
+            with self.condition:
+                while index == len(self.events) and not self.done:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    self.condition.wait(0.1)  # Plain threading.Events can't notify us
+                new_events = self.events[index:]
+                index += len(new_events)
+                done = self.done and index == len(self.events)
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled(f"Generation for {self.key[0]} was cancelled")
+            for kind, payload in new_events:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if on_delta:
+                    on_delta(kind, payload)
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return self.result + (ttft,)
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+_inflight = {}  # (model_name, prompt, previous_response_id) -> _SharedStream
+_inflight_lock = threading.Lock()
+
+def _forget_stream(shared):
+    with _inflight_lock:
+        if _inflight.get(shared.key) is shared:
+            del _inflight[shared.key]
+
+def _leave_stream(shared, token):
+    with _inflight_lock:
+        if token not in shared.subscribers:
+            return
+        shared.subscribers.discard(token)
+        abandoned = not shared.subscribers
+        if abandoned and _inflight.get(shared.key) is shared:
+            del _inflight[shared.key]  # A new identical request must not join one being aborted
+    if abandoned:
+        shared.cancel_scope.set()
+    shared.wake()
+
+def stream_generate(model_name, prompt, on_delta=None, client=None, cancel_event=None, cache_mode=None, previous_response_id=None, endpoint=None):
+    """Run generate_text_stream to completion, reporting deltas to `on_delta`.
+
+    Identical (model_name, prompt, previous_response_id) calls that overlap
+    share one request; a caller that joins late is first given everything
+    streamed so far.
+
+    If `cancel_event` is set while streaming, the caller leaves the request
+    and GenerationCancelled is raised. The HTTP request itself is aborted
+    once every caller sharing it has left; with a CancelScope that happens
+    even while a read is blocked, a plain threading.Event is noticed within
+    100 ms.
+
+    Without a `client`, the request goes to `endpoint` or else to the host
+    `endpoints` picks for the model.
+
+    Returns:
+        tuple: (generated_text, model_instance_id, stats, ttft) where ttft is
+        the time to first token in seconds, or None if nothing was streamed.
+    """
+    key = (model_name, prompt, previous_response_id)
+    token = object()
+    with _inflight_lock:
+        shared = _inflight.get(key)
+        if shared is None:
+            shared = _inflight[key] = _SharedStream(key, client, cache_mode, endpoint)
+            shared.start()
+        shared.subscribers.add(token)
+
+    leave = lambda: _leave_stream(shared, token)
+    add_callback = getattr(cancel_event, "add_callback", None)
+    if add_callback:
+        add_callback(leave)
+    try:
+        return shared.follow(on_delta, cancel_event)
+    finally:
+        if add_callback:
+            cancel_event.remove_callback(leave)
+        leave()
+
+def _record_generation_metrics(model_name, start, ttft, end, deltas, stats):
+    """Record ttft, total latency and throughput for one finished stream."""
+    metrics.observe(model_name, "ttft", ttft)
+    metrics.observe(model_name, "total_latency", end - start)
+    # Prefer the server's token count; each streamed delta is roughly one token otherwise
+    tokens = (stats or {}).get("total_output_tokens") or deltas
+    generating = end - start - (ttft or 0.0)
+    if tokens and generating > 0:
+        metrics.observe(model_name, "tokens_per_second", tokens / generating)
+
+SESSION_TOKEN_BUDGET = 4096  # Estimated tokens of history replayed when the server can't continue a response
+SESSION_CHARS_PER_TOKEN = 4  # Rough token estimate; LM Studio's own counts only cover what was sent
+SESSION_SUMMARY_CHARS = 120  # Characters kept from each prompt folded into the summary
+
+def estimate_tokens(text):
+    """Rough token count for `text`."""
+    return -(-len(text) // SESSION_CHARS_PER_TOKEN)
+
+class ConversationSession:
+    """Multi-turn history for one pane and model.
+
+    When the last reply came with a response_id, the next turn sends only
+    the new prompt plus previous_response_id, so LM Studio continues from
+    its stored state and processes just that turn. Otherwise the history is
+    replayed as a transcript kept under `token_budget`: once it is over,
+    the oldest turns are folded into one summary line per prompt until it
+    is down to 3/4 of the budget. Trimming in one go keeps the transcript's
+    prefix, and with it LM Studio's prompt cache, the same for several turns.
+
+    prepare() leaves the session unchanged, so a cancelled or superseded
+    turn leaves no trace; record() adds the turn once its reply arrived.
+    """
+
+    def __init__(self, model_name, token_budget=SESSION_TOKEN_BUDGET):
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.turns = deque()  # (prompt, reply, tokens), oldest first
+        self.summary = deque()  # (line, tokens) standing in for trimmed turns
+        self.history_tokens = 0  # Estimated tokens of turns and summary
+        self.total_tokens = 0  # Estimated tokens of every turn so far, trimmed or not
+        self.turn_count = 0
+        self.response_id = None
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def _transcript(self, prompt):
+        if not self.turns and not self.summary:
+            return prompt  # First turn, same as a one-off prompt
+        parts = []
+        if self.summary:
+            parts.append("Earlier in this conversation the user asked:\n" + "\n".join(line for line, _ in self.summary) + "\n")
+        for user, assistant, _ in self.turns:
+            parts.append(f"User: {user}\nAssistant: {assistant}\n")
+        parts.append(f"User: {prompt}\nAssistant:")
+        return "\n".join(parts)
+
+    def prepare(self, prompt):
+        """Plan the request for the next turn without changing the session.
+
+        Returns:
+            dict: session, prompt, turn, input and previous_response_id to
+            send, fallback_input (the transcript, in case the server no longer
+            has the previous response), and estimated prompt_tokens and tokens_saved.
+        """
+        with self._lock:
+            transcript = self._transcript(prompt)
+            plan = {
+                "session": self,
+                "prompt": prompt,
+                "turn": self.turn_count + 1,
+                "input": prompt if self.response_id else transcript,
+                "previous_response_id": self.response_id,
+                "fallback_input": transcript,
+            }
+            plan["prompt_tokens"] = estimate_tokens(plan["input"])
+            plan["tokens_saved"] = max(self.total_tokens + estimate_tokens(prompt) - plan["prompt_tokens"], 0)
+            return plan
+
+    @staticmethod
+    def replay(plan):
+        """The same turn sent as the full transcript instead of continuing a response."""
+        return dict(plan, input=plan["fallback_input"], previous_response_id=None,
+                    prompt_tokens=estimate_tokens(plan["fallback_input"]),
+                    tokens_saved=max(plan["tokens_saved"] + plan["prompt_tokens"] - estimate_tokens(plan["fallback_input"]), 0))
+
+    def record(self, plan, reply, stats):
+        """Add a finished turn planned by prepare() or replay()."""
+        with self._lock:
+            tokens = estimate_tokens(plan["prompt"]) + estimate_tokens(reply)
+            self.turns.append((plan["prompt"], reply, tokens))
+            self.history_tokens += tokens
+            self.total_tokens += tokens
+            self.turn_count += 1
+            self.tokens_saved += plan["tokens_saved"]
+            # No response_id means the server can't continue; replay from now on
+            self.response_id = (stats or {}).get("response_id")
+            if self.history_tokens > self.token_budget:
+                self._trim(self.token_budget * 3 // 4)
+        metrics.observe(self.model_name, "prompt_tokens", plan["prompt_tokens"])
+        metrics.observe(self.model_name, "prompt_tokens_saved", plan["tokens_saved"])
+
+    def _trim(self, target):
+        while self.turns and self.history_tokens > target:
+            prompt, _, tokens = self.turns.popleft()
+            line = "- " + " ".join(prompt.split())[:SESSION_SUMMARY_CHARS]
+            line_tokens = estimate_tokens(line)
+            self.summary.append((line, line_tokens))
+            self.history_tokens += line_tokens - tokens
+        # The summary itself gets at most a quarter of the budget
+        summary_tokens = sum(line_tokens for _, line_tokens in self.summary)
+        while self.summary and summary_tokens > self.token_budget // 4:
+            _, line_tokens = self.summary.popleft()
+            summary_tokens -= line_tokens
+            self.history_tokens -= line_tokens
+
+    @staticmethod
+    def describe(plan):
+        """One line for the pane, e.g. "turn 3, continued from the last response, ~812 prompt tokens saved"."""
+        if plan["previous_response_id"]:
+            how = "continued from the last response"
+        else:
+            how = "history resent" if plan["turn"] > 1 else "new conversation"
+        return f"turn {plan['turn']}, {how}, ~{plan['prompt_tokens']} prompt tokens sent, ~{plan['tokens_saved']} saved"
+
+COMPARE_WORKERS = 2  # Processes diffing and scoring outputs
+COMPARE_INTERVAL = 0.5  # Seconds between comparisons of streamed partial outputs
+COMPARE_DIFF_HUNKS = 5  # Differing spans kept per pair for display
+
+def tokenize(text):
+    """Split text into words and punctuation for diffing."""
+    import re
+    return re.findall(r"\w+|[^\w\s]", text or "")
+
+def score_json(text, reference=None):
+    """1.0 if the output, or its first ```json block, parses as JSON, else 0.0."""
+    import re
+    block = re.search(r"```(?:json)?\s*\n(.*?)```", text or "", re.DOTALL)
+    try:
+        json.loads(block.group(1) if block else text)
+    except (TypeError, ValueError):
+        return 0.0
+    return 1.0
+
+def score_regex(text, reference=None, pattern=""):
+    """1.0 if `pattern` is found in the output, else 0.0."""
+    import re
+    return 1.0 if re.search(pattern, text or "") else 0.0
+
+def score_similarity(text, reference=None):
+    """Token-level similarity to the reference answer, 0.0 to 1.0; None without a reference."""
+    import difflib
+    if reference is None:
+        return None
+    return difflib.SequenceMatcher(None, tokenize(text), tokenize(reference), autojunk=False).ratio()
+
+# name -> (function, options). Functions run in worker processes, so they must be
+# defined at module level in an importable module; each is called as
+# function(text, reference, **options) and returns a score or None.
+COMPARE_SCORERS = {
+    "json": (score_json, {}),
+    "similarity": (score_similarity, {}),
+}
+
+def _ratio(base, other):
+    return other / base if base and other is not None else None
+
+def diff_outputs(base, other):
+    """Token-level diff of two outputs.
+
+    Returns:
+        dict: similarity (0.0 to 1.0), the token counts of both outputs
+        (base_tokens, other_tokens), how many tokens are equal/inserted/deleted/
+        replaced from `base` to `other`, and the first COMPARE_DIFF_HUNKS
+        differing spans as [op, base_text, other_text].
+    """
+    import difflib
+    base_tokens, other_tokens = tokenize(base), tokenize(other)
+    matcher = difflib.SequenceMatcher(None, base_tokens, other_tokens, autojunk=False)
+    counts = {"equal": 0, "inserted": 0, "deleted": 0, "replaced": 0}
+    hunks = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            counts["equal"] += i2 - i1
+            continue
+        if op == "insert":
+            counts["inserted"] += j2 - j1
+        elif op == "delete":
+            counts["deleted"] += i2 - i1
+        else:
+            counts["replaced"] += max(i2 - i1, j2 - j1)
+        if len(hunks) < COMPARE_DIFF_HUNKS:
+            hunks.append([op, " ".join(base_tokens[i1:i2]), " ".join(other_tokens[j1:j2])])
+    return dict(similarity=matcher.ratio(), base_tokens=len(base_tokens), other_tokens=len(other_tokens), hunks=hunks, **counts)
+
+def compare_outputs(outputs, scorers=None, reference=None):
+    """Diff and score the outputs several models gave for one prompt.
+
+    Runs in a worker process, so everything passed in must be picklable.
+
+    Args:
+        outputs (list): (key, text, elapsed, ttft) per model. The first one is
+            the baseline the others are diffed against; elapsed and ttft may be None.
+        scorers (dict, optional): name -> (function, options). Defaults to COMPARE_SCORERS.
+        reference (str, optional): Expected answer, for scorers that use one.
+
+    Returns:
+        dict: "scores" maps key -> {scorer name: score}; "pairs" has one entry per
+        non-baseline output with its diff_outputs() result and the length, token,
+        latency and time-to-first-token ratios against the baseline.
+    """
+    scorers = COMPARE_SCORERS if scorers is None else scorers
+    scores = {}
+    for key, text, _, _ in outputs:
+        scores[key] = {}
+        for name, (function, options) in scorers.items():
+            try:
+                scores[key][name] = function(text or "", reference, **options)
+            except Exception:
+                scores[key][name] = None  # A broken scorer shouldn't hide the rest
+    pairs = []
+    if not outputs:
+        return {"scores": scores, "pairs": pairs}
+    base_key, base_text, base_elapsed, base_ttft = outputs[0]
+    for key, text, elapsed, ttft in outputs[1:]:
+        pair = diff_outputs(base_text, text)
+        pair.update(
+            base=base_key,
+            other=key,
+            length_ratio=_ratio(len(base_text or ""), len(text or "")),
+            token_ratio=_ratio(pair["base_tokens"], pair["other_tokens"]),
+            latency_ratio=_ratio(base_elapsed, elapsed),
+            ttft_ratio=_ratio(base_ttft, ttft),
+        )
+        pairs.append(pair)
+    return {"scores": scores, "pairs": pairs}
+
+_compare_pool = None
+_compare_pool_lock = threading.Lock()
+
+def compare_pool():
+    """The process pool comparisons run in, started on first use."""
+    global _compare_pool
+    with _compare_pool_lock:
+        if _compare_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Spawned rather than forked: the GUI process has Tk and several threads running
+            _compare_pool = ProcessPoolExecutor(max_workers=COMPARE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _compare_pool
+
+class Comparator:
+    """Compares the outputs of one prompt in the background as they stream in.
+
+    append() adds each model's streamed text and finish() its final output
+    and timings. A comparison is submitted to compare_pool() at most every
+    COMPARE_INTERVAL seconds and never more than one at a time; updates
+    arriving meanwhile are folded into the next one, so only the latest
+    text is ever compared; keys that haven't streamed any answer yet are
+    left out until the end. Once every key has finished a last comparison
+    always runs. A key that failed or was cancelled is reported with fail()
+    instead; it is left out of the comparison and listed under "failed" in
+    the result. on_result(result, final) is called from a pool thread with
+    each compare_outputs() result.
+    """
+
+    def __init__(self, keys, on_result, scorers=None, reference=None, interval=COMPARE_INTERVAL):
+        self.keys = list(keys)  # The first key is the baseline
+        self.on_result = on_result
+        self.scorers = COMPARE_SCORERS if scorers is None else scorers  # Resolved here so scorers added at runtime reach the workers
+        self.reference = reference
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._chunks = {key: [] for key in self.keys}  # key -> answer text so far, joined when compared
+        self._timings = {}  # key -> (elapsed, ttft) once finished
+        self._final = set()
+        self._failed = set()
+        self._running = False
+        self._dirty = False
+        self._submitted_at = 0.0
+        self.closed = False
+
+    def append(self, key, text):
+        """Add streamed answer text for `key`."""
+        with self._lock:
+            if self.closed or key not in self._chunks:
+                return
+            self._chunks[key].append(text)
+            self._dirty = True
+        self._submit()
+
+    def reset(self, key):
+        """Forget the text streamed so far for `key`, e.g. when a retry starts over."""
+        with self._lock:
+            if key in self._chunks:
+                self._chunks[key] = []
+                self._dirty = True
+
+    def finish(self, key, text, elapsed=None, ttft=None):
+        """Record the final output of `key`; the last comparison runs once every key is finished."""
+        with self._lock:
+            if self.closed or key not in self._chunks:
+                return
+            self._chunks[key] = [text or ""]
+            self._timings[key] = (elapsed, ttft)
+            self._final.add(key)
+            self._dirty = True
+        self._submit()
+
+    def fail(self, key):
+        """Leave `key` out of the comparison because it has no usable output."""
+        with self._lock:
+            if self.closed or key not in self._chunks:
+                return
+            self._failed.add(key)
+            self._final.add(key)
+            self._dirty = True
+        self._submit()
+
+    def close(self):
+        """Stop comparing, e.g. when a newer prompt replaces this one."""
+        with self._lock:
+            self.closed = True
+
+    def _submit(self):
+        with self._lock:
+            final = len(self._final) == len(self.keys)
+            if self.closed or self._running or not self._dirty:
+                return
+            if not final and time.monotonic() - self._submitted_at < self.interval:
+                return  # The next update or the final one will pick this up
+            # Until the end, a key that hasn't streamed any answer yet (e.g. still reasoning) isn't compared
+            keys = [key for key in self.keys if key not in self._failed and (final or key in self._final or any(self._chunks[key]))]
+            if not keys and not final:
+                return
+            outputs = [(key, "".join(self._chunks[key])) + self._timings.get(key, (None, None)) for key in keys]
+            failed = [key for key in self.keys if key in self._failed]
+            self._running, self._dirty = True, False
+            self._submitted_at = time.monotonic()
+        future = compare_pool().submit(compare_outputs, outputs, self.scorers, self.reference)
+        future.add_done_callback(lambda done: self._done(done, final, failed))
+
+    def _done(self, future, final, failed):
+        try:
+            result = dict(future.result(), failed=failed)
+        except Exception as e:
+            print(f"Comparison failed: {e}")
+            result = None
+        with self._lock:
+            self._running = False
+            closed = self.closed
+        if result is not None and not closed:
+            self.on_result(result, final)
+        self._submit()
+
+ENGINE_MAX_CONCURRENCY = 4  # Generations allowed to run at once across all models
+PRIORITY_INTERACTIVE = 0  # Prompts typed into the window
+PRIORITY_BATCH = 10  # Batch mode; waits while interactive work is queued
+
+class PriorityGate:
+    """An asyncio semaphore that hands free slots to the lowest priority value first.
+
+    Waiters with the same priority are served in arrival order. Only use it
+    from one event loop at a time.
+    """
+
+    def __init__(self, slots):
+        self._free = slots
+        self._waiters = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        import asyncio
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # The slot was handed over just as we were cancelled
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_INTERACTIVE):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+def _default_worker(key, model_name, prompt, cancel_event):
+    return stream_generate(model_name, prompt, cancel_event=cancel_event)
+
+class GenerationEngine:
+    """Schedules prompts onto models from an asyncio event loop.
+
+    The blocking HTTP calls run in a thread pool sized to `max_concurrency`
+    and a PriorityGate keeps extra jobs waiting on the loop, so comparing
+    six models uses no more threads than comparing two, and interactive
+    jobs start before queued batch jobs. Every job has a key (the UI uses
+    the pane name) and can be cancelled on its own; starting a job under a
+    key that is still running cancels the old one, so a newer prompt
+    supersedes the last one instead of queueing behind it.
+
+    A worker is called as worker(key, model_name, prompt, cancel_event) in a
+    pool thread and returns (text, model_id, stats, ttft). cancel_event is
+    a CancelScope, so work blocked on the network can be aborted.
+    """
+
+    def __init__(self, max_concurrency=ENGINE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="generation")
+        self._gate = PriorityGate(max_concurrency)
+        self._lock = threading.Lock()
+        self._jobs = {}  # key -> (loop, task, cancel_event)
+
+    async def _run_job(self, result, prompt, worker, cancel_event, priority):
+        import asyncio
+        key, model_name = result["key"], result["model"]
+        start = time.perf_counter()
+        try:
+            async with self._gate.slot(priority):
+                result["queue_wait"] = time.perf_counter() - start
+                metrics.observe(model_name, "queue_wait", result["queue_wait"])
+                loop = asyncio.get_running_loop()
+                text, model_id, stats, ttft = await loop.run_in_executor(
+                    self.executor, worker, key, model_name, prompt, cancel_event
+                )
+            result.update(text=text, model_id=model_id, stats=stats, ttft=ttft)
+        except (asyncio.CancelledError, GenerationCancelled):
+            cancel_event.set()  # Aborts the request the pool thread is waiting on
+            result["cancelled"] = True
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            result["elapsed"] = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    async def _outcome(task, result):
+        import asyncio
+        # A job cancelled before it started never runs its own except clause
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            result["cancelled"] = True
+            return result
+
+    def _forget(self, key, task):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job and job[1] is task:
+                del self._jobs[key]
+
+    async def fan_out(self, prompt, targets, worker=None, ordered=False, priority=PRIORITY_INTERACTIVE):
+        """Send `prompt` to every (key, model_name) in `targets` at the same time.
+
+        Yields one result dict per target as soon as it finishes, or in
+        `targets` order if `ordered` is True. Jobs still running when the
+        consumer stops iterating are cancelled, and so are earlier jobs
+        still running under one of the keys.
+        """
+        import asyncio
+        worker = worker or _default_worker
+        loop = asyncio.get_running_loop()
+        tasks = []
+        outcomes = []
+        for index, (key, model_name) in enumerate(targets):
+            result = {
+                "index": index,
+                "key": key,
+                "model": model_name,
+                "text": None,
+                "model_id": None,
+                "stats": None,
+                "ttft": None,
+                "error": None,
+                "cancelled": False,
+                "queue_wait": None,
+                "elapsed": 0.0,
+            }
+            cancel_event = CancelScope()
+            self.cancel(key)  # Superseded by this prompt
+            task = loop.create_task(self._run_job(result, prompt, worker, cancel_event, priority))
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            with self._lock:
+                self._jobs[key] = (loop, task, cancel_event)
+            tasks.append(task)
+            outcomes.append(loop.create_task(self._outcome(task, result)))
+
+        try:
+            if ordered:
+                for outcome in outcomes:
+                    yield await outcome
+            else:
+                for next_done in asyncio.as_completed(outcomes):
+                    yield await next_done
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def run(self, prompt, targets, worker=None, priority=PRIORITY_INTERACTIVE):
+        """Run fan_out to completion and return the results in `targets` order."""
+        return [result async for result in self.fan_out(prompt, targets, worker, ordered=True, priority=priority)]
+
+    def cancel(self, key):
+        """Cancel the job running under `key`; safe to call from any thread."""
+        with self._lock:
+            job = self._jobs.get(key)
+        if not job:
+            return False
+        loop, task, cancel_event = job
+        cancel_event.set()
+        loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def cancel_all(self):
+        """Cancel every running job, e.g. when the window closes, so hosts stop generating."""
+        with self._lock:
+            keys = list(self._jobs)
+        for key in keys:
+            self.cancel(key)
+
+def start_background_loop():
+    """Start an asyncio event loop in a daemon thread and return the loop."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="engine-loop", daemon=True).start()
+    return loop
+
+BATCH_PROMPT_FIELDS = ("prompt", "input", "body")  # Tried in order when --prompt-field isn't given
+BATCH_READ_AHEAD = 2  # Prompts queued per worker beyond those running
+BATCH_REFERENCE_FIELDS = ("reference", "expected")  # Optional expected answer for the comparison scorers
+
+def iter_batch_prompts(path, prompt_field=None):
+    """Yield (line_number, record_id, prompt, reference) for each usable line of a JSONL file.
+
+    The file is read lazily, one line at a time. A line may be a JSON string
+    or an object holding the prompt in `prompt_field` (or one of
+    BATCH_PROMPT_FIELDS); lines without a prompt are reported and skipped.
+    An object may also hold an expected answer in one of
+    BATCH_REFERENCE_FIELDS, otherwise reference is None.
+    """
+    fields = (prompt_field,) if prompt_field else BATCH_PROMPT_FIELDS
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Skipping line {line_number}: not valid JSON")
+                continue
+
+            if isinstance(record, str):
+                yield line_number, line_number, record, None
+                continue
+            prompt = None
+            if isinstance(record, dict):
+                prompt = next((record[field] for field in fields if isinstance(record.get(field), str)), None)
+            if prompt is None:
+                print(f"Skipping line {line_number}: no prompt field ({', '.join(fields)})")
+                continue
+            reference = next((record[field] for field in BATCH_REFERENCE_FIELDS if isinstance(record.get(field), str)), None)
+            yield line_number, record.get("id") or record.get("request_id") or line_number, prompt, reference
+
+def load_completed_results(output_path):
+    """Return the (line, model) pairs already answered successfully in a batch output file.
+
+    Rows with an error or without text don't count, so a rerun retries them.
+
+    A crash can leave a half-written last line; everything from the first
+    incomplete or unparsable line onwards is truncated so the run can append
+    cleanly and redo those prompts.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    valid_end = 0
+    with open(output_path, "rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                break
+            # Comparison rows have no model; failed answers are retried
+            if "model" in row and row.get("error") is None and row.get("text") is not None:
+                completed.add((row.get("line"), row.get("model")))
+            valid_end += len(raw)
+
+    if valid_end < os.path.getsize(output_path):
+        print(f"Truncating incomplete output after byte {valid_end} of {output_path}")
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_end)
+    return completed
+
+async def run_batch(input_path, output_path, models, workers=4, prompt_field=None, cache_mode=None, compare=True):
+    """Send every prompt in `input_path` to each of `models`, appending results to `output_path`.
+
+    At most `workers` generations run at once and only a few prompts are read
+    ahead, so memory stays flat however long the input is. Each result is
+    written and flushed as one JSONL row the moment it finishes. Prompts
+    already answered successfully in `output_path` are skipped, which makes
+    re-running after a crash resume where it stopped and retry what failed.
+
+    With `compare` and more than one model, once every model has answered a
+    prompt a {"line", "id", "comparison"} row with the compare_outputs()
+    result is written too; the comparison runs in compare_pool().
+
+    Returns:
+        int: number of result rows written by this run.
+    """
+    import asyncio
+    engine = GenerationEngine(max_concurrency=workers)
+    completed = load_completed_results(output_path)
+
+    def worker(key, model_name, prompt, cancel_event):
+        return stream_generate(model_name, prompt, cancel_event=cancel_event, cache_mode=cache_mode)
+
+    if completed:
+        print(f"Resuming: {len(completed)} results already in {output_path}")
+
+    written = 0
+    pending = set()
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(row):
+            # Rows are only written from the event loop thread, one at a time
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def run_line(line_number, record_id, prompt, reference, targets):
+            nonlocal written
+            results = []
+            async for result in engine.fan_out(prompt, targets, worker=worker, priority=PRIORITY_BATCH):
+                row = {
+                    "line": line_number,
+                    "id": record_id,
+                    "model": result["model"],
+                    "text": result["text"],
+                    "model_id": result["model_id"],
+                    "stats": result["stats"],
+                    "ttft": result["ttft"],
+                    "queue_wait": result["queue_wait"],
+                    "elapsed": result["elapsed"],
+                    "error": result["error"],
+                }
+                write(row)
+                written += 1
+                results.append(result)
+            # Only compare prompts whose every answer came from this run and succeeded
+            usable = all(r["error"] is None and r["text"] is not None for r in results)
+            if compare and len(models) > 1 and len(results) == len(models) and usable:
+                outputs = [(r["model"], r["text"], r["elapsed"], r["ttft"]) for r in sorted(results, key=lambda r: r["index"])]
+                comparison = await asyncio.get_running_loop().run_in_executor(compare_pool(), compare_outputs, outputs, COMPARE_SCORERS, reference)
+                write({"line": line_number, "id": record_id, "comparison": comparison})
+
+        try:
+            for line_number, record_id, prompt, reference in iter_batch_prompts(input_path, prompt_field):
+                targets = [((line_number, model), model) for model in models if (line_number, model) not in completed]
+                if not targets:
+                    continue
+                while len(pending) >= workers * BATCH_READ_AHEAD:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.create_task(run_line(line_number, record_id, prompt, reference, targets)))
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            for task in pending:
+                task.cancel()
+            engine.executor.shutdown(wait=False, cancel_futures=True)
+    return written
+
+def batch_main(argv=None):
+    """Command-line entry point for headless batch runs."""
+    import argparse
+    import asyncio
+    parser = argparse.ArgumentParser(description="Run prompts from a JSONL file against LM Studio models without the GUI.")
+    parser.add_argument("--batch", metavar="INPUT", required=True, help="JSONL file with one prompt per line")
+    parser.add_argument("--output", metavar="OUTPUT", help="JSONL file to append results to (default: INPUT with .results.jsonl)")
+    parser.add_argument("--models", default=",".join(available_models[2:0:-1] or available_models[:1]), help="Comma-separated models to send each prompt to")
+    parser.add_argument("--workers", type=int, default=ENGINE_MAX_CONCURRENCY, help="Generations to run at once")
+    parser.add_argument("--cache", choices=CACHE_MODES, default=CACHE_MODE, help="Response cache mode; 'deterministic' skips requests sampled with temperature > 0")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the response cache before running, e.g. after changing a model")
+    parser.add_argument("--metrics", metavar="PATH", help="Write per-model latency metrics at the end (.csv, otherwise Prometheus text)")
+    parser.add_argument("--prompt-field", help="JSON field holding the prompt (default: first of %s)" % ", ".join(BATCH_PROMPT_FIELDS))
+    parser.add_argument("--no-compare", action="store_true", help="Don't write a comparison row after each prompt's answers")
+    args = parser.parse_args(argv)
+
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+    output_path = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.clear_cache:
+        response_cache.clear()
+        print(f"Cleared the response cache at {response_cache.path}")
+
+    start = time.perf_counter()
+    try:
+        written = asyncio.run(run_batch(args.batch, output_path, models, args.workers, args.prompt_field, args.cache, not args.no_compare))
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun the same command to resume from {output_path}")
+        return 130
+    print(f"Wrote {written} results to {output_path} in {time.perf_counter() - start:.1f} s")
+    if args.metrics:
+        metrics.export(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+    if args.cache != "off":
+        cache_stats = response_cache.stats()
+        print(f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    connections = endpoints.connection_stats()
+    print(f"Connections: {connections['requests']} requests, {connections['new_connections']} new, {connections['reused_connections']} reused")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(batch_main())
@@ -0,0 +1,88 @@
+"""AdaptiveLimiter decisions for synthetic hosts, driven by a fake clock."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import lmstudio_engine
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(lmstudio_engine.time, "monotonic", fake)
+    return fake
+
+def run(limiter, clock, throughput, demand, generations, duration=1.0):
+    """Run `generations` in rounds of up to `demand` at once on a host whose aggregate tok/s at n at once is throughput(n)."""
+    limits = []
+    done = 0
+    while done < generations:
+        running = min(demand, limiter.limit, generations - done)
+        for _ in range(running):
+            limiter.acquire()
+        clock.now += duration
+        for _ in range(running):
+            limiter.release(throughput(running) * duration / running, duration)
+        done += running
+        limits.append(limiter.limit)
+    return limits
+
+def changes(limiter):
+    return [(old, new) for _, old, new, _ in limiter.decisions]
+
+def test_shared_host_is_serialized(clock):
+    """Two panes on one GPU: running both at once gains nothing, so they take turns."""
+    limiter = lmstudio_engine.AdaptiveLimiter("shared")
+    limits = run(limiter, clock, throughput=lambda n: 100.0, demand=2, generations=200)
+
+    assert changes(limiter)[0] == (2, 1)
+    assert limiter.limit == 1
+    assert max(limits[len(limits) // 2:]) <= 2  # Only the occasional probe goes back to 2
+    assert all(new == 1 for old, new in changes(limiter) if old == 2)
+
+def test_parallel_host_stays_parallel(clock):
+    """A host that scales returns to 2 right after measuring 1 and then allows more than the panes need."""
+    limiter = lmstudio_engine.AdaptiveLimiter("parallel")
+    run(limiter, clock, throughput=lambda n: 100.0 * n, demand=2, generations=200)
+
+    assert changes(limiter) == [(2, 1), (1, 2), (2, 3)]
+    assert limiter.limit == 3
+
+def test_parallel_host_grows_to_max_limit(clock):
+    """Rounds of 3 close windows of 4 mid-round; the level-3 measurement must still see 3x the throughput."""
+    limiter = lmstudio_engine.AdaptiveLimiter("parallel")
+    run(limiter, clock, throughput=lambda n: 100.0 * n, demand=8, generations=400)
+
+    assert limiter.limit == lmstudio_engine.ADAPTIVE_MAX_LIMIT
+
+def test_congested_host_halves(clock):
+    """Throughput that falls past 2 at once drops the limit back down."""
+    limiter = lmstudio_engine.AdaptiveLimiter("congested", limit=4)
+    run(limiter, clock, throughput=lambda n: {1: 100.0, 2: 180.0}.get(n, 120.0), demand=4, generations=400)
+
+    assert limiter.limit == 2
+
+def test_failed_or_cached_generations_are_not_measured(clock):
+    limiter = lmstudio_engine.AdaptiveLimiter("host")
+    for _ in range(20):
+        limiter.acquire()
+        clock.now += 1.0
+        limiter.release(None, 1.0)
+
+    assert limiter.limit == 2 and not limiter.decisions and not limiter.throughput
+
+def test_fixed_limiter_never_changes(clock):
+    limiter = lmstudio_engine.AdaptiveLimiter("fixed", limit=3, adaptive=False)
+    run(limiter, clock, throughput=lambda n: 100.0, demand=3, generations=100)
+
+    assert limiter.limit == 3 and not limiter.decisions
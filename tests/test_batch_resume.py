@@ -0,0 +1,37 @@
+"""Resuming a batch run from its output file after a crash."""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import lmstudio_engine
+
+def write_rows(path, rows, tail=""):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+        f.write(tail)
+
+def test_only_successful_rows_count_as_completed(tmp_path):
+    output = tmp_path / "prompts.results.jsonl"
+    write_rows(output, [
+        {"line": 1, "model": "a", "text": "answer", "error": None},
+        {"line": 1, "model": "b", "text": None, "error": "HTTPError: 500"},
+        {"line": 2, "model": "a", "text": None, "error": None},
+        {"line": 1, "id": 1, "comparison": {}},
+    ])
+
+    assert lmstudio_engine.load_completed_results(str(output)) == {(1, "a")}
+
+def test_torn_last_line_is_truncated(tmp_path):
+    output = tmp_path / "prompts.results.jsonl"
+    write_rows(output, [{"line": 1, "model": "a", "text": "answer", "error": None}], tail='{"line": 2, "model": "a", "te')
+    intact = len(json.dumps({"line": 1, "model": "a", "text": "answer", "error": None})) + 1
+
+    assert lmstudio_engine.load_completed_results(str(output)) == {(1, "a")}
+    assert os.path.getsize(output) == intact
+
+def test_missing_output_has_nothing_completed(tmp_path):
+    assert lmstudio_engine.load_completed_results(str(tmp_path / "missing.jsonl")) == set()
@@ -0,0 +1,25 @@
+"""Config file loading and the request bodies built from it."""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import lmstudio_engine
+
+def test_defaults_merge_field_by_field(tmp_path):
+    path = tmp_path / "lmstudio_config.json"
+    path.write_text(json.dumps({"defaults": {"chat": {"max_output_tokens": 512}}}), encoding="utf-8")
+
+    config = lmstudio_engine.load_config(str(path))
+
+    assert config["defaults"]["chat"] == {"temperature": 0.7, "max_output_tokens": 512}
+    assert config["defaults"]["load"] == {"flash_attention": True}
+
+def test_profile_body_matches_json_encoding():
+    profile = lmstudio_engine.ModelProfile("m", {"temperature": 0.2, "stream": False}, {"context_length": 4096})
+    body = json.loads(profile.body('héllo "x"', stream=True, previous_response_id="resp_1"))
+
+    assert body == {"model": "m", "temperature": 0.2, "input": 'héllo "x"', "previous_response_id": "resp_1", "stream": True}
+    assert profile.load_body == {"model": "m", "context_length": 4096}